@@ -17,6 +17,9 @@ from .nn import sequence_nll_loss_bits
 # import audio dataset management
 #from dataset import SampleRNNDataset
 from .dataset import MelodyDataset
+from .dataset import MelodyStream
 
 #from dataset import DataLoader
 from .dataset import MelodyDataLoader
+from .dataset import BucketBatchSampler
+from .dataset import pad_collate
@@ -0,0 +1,673 @@
+''' imports '''
+
+# filesystem management
+import os
+import sys
+import subprocess
+import tempfile
+
+# timing
+import time
+
+# array handling
+import numpy as np
+
+# midi file import and parse
+from mido import MidiFile
+
+# native midi decoder
+import smf
+
+# melody extraction from note intervals
+import extract
+
+# midi dataset
+from dataset import MelodyDataset
+
+# tensors, sample-rnn model and generation
+import torch
+import utils
+import kernel
+import int8
+from nn import sequence_nll_loss_bits
+from optim import gradient_clipping
+from model import SampleRNN, Runner, Predictor, Generator
+
+# numpy only generation engine
+import engine
+
+
+
+def tracks2matrix_ref(tracks: list):
+
+    ''' reference (per-delta stack and concatenate) tracks to matrix conversion '''
+
+    m = []
+
+    for track in tracks:
+
+        N = np.zeros(128, dtype = np.int16)
+
+        M = np.zeros((128, 1), dtype = np.int16)
+
+        for msg in track:
+
+            if int(msg['time']) != 0:
+
+                n = np.stack([ N for _ in range( int(msg['time']) ) ]).T
+
+                M = np.concatenate( [M, n], axis = 1 )
+
+            N[int(msg['note'])] = int(msg['velocity'])
+
+        m.append(M)
+
+    s = max([ track.shape[1] for track in m ])
+
+    M = np.stack([ np.pad(track, ((0, 0), (0, s - track.shape[1])))
+        for track in m ], axis = 2)
+
+    return M
+
+
+def bench_tracks2matrix(dir_path: str, n: int = None):
+
+    ''' benchmark vectorised tracks2matrix against reference, check identical values
+
+    Args:
+        dir_path (str): directory of midi files
+        n (int): number of files to benchmark, default all
+    '''
+
+    # init dataset without import
+    dataset = MelodyDataset(dir_path)
+
+    # get tracks for each midi file up front, exclude parse time
+    tracks = [ dataset.midi2tracks(midi) for midi in dataset.midi_files[:n] ]
+
+    # time reference and vectorised conversion per file
+    t_ref = t_vec = 0.
+
+    for track in tracks:
+
+        t = time.perf_counter()
+        ref = tracks2matrix_ref(track)
+        t_ref += time.perf_counter() - t
+
+        t = time.perf_counter()
+        vec = dataset.tracks2matrix(track)
+        t_vec += time.perf_counter() - t
+
+        # ensure identical output (reference int16, vectorised uint8)
+        assert ref.shape == vec.shape and np.array_equal(ref, vec)
+
+    print('tracks2matrix: {} files, ref {:.2f} s, vec {:.2f} s, speedup {:.1f}x'.format(
+        len(tracks), t_ref, t_vec, t_ref / t_vec))
+
+
+
+def bench_smf(dir_path: str):
+
+    ''' benchmark native midi decoder against mido, check events agree
+
+    Every event in every track is compared against mido messages (delta time,
+    type, channel, note / velocity for note events), and extracted melodies
+    compared for both backends.
+
+    Args:
+        dir_path (str): directory of midi files
+    '''
+
+    # get midi file paths
+    paths = [ os.path.join(dir_path, name) for name in sorted(os.listdir(dir_path))
+        if 'mid' in name[-4:] ]
+
+    t_mido = t_smf = 0.
+
+    for path in paths:
+
+        t = time.perf_counter()
+        midi = MidiFile(path)
+        t_mido += time.perf_counter() - t
+
+        t = time.perf_counter()
+        events = smf.read_midi(path)
+        t_smf += time.perf_counter() - t
+
+        assert events.ticks_per_beat == midi.ticks_per_beat
+        assert len(events.tracks) == len(midi.tracks)
+
+        # compare events per track
+        for track, msgs in zip(events.tracks, midi.tracks):
+
+            assert len(track) == len(msgs), path
+
+            for event, msg in zip(track, msgs):
+
+                assert event['time'] == msg.time, path
+
+                if msg.type in ['note_on', 'note_off']:
+                    assert event['type'] == (smf.NOTE_ON if msg.type == 'note_on'
+                        else smf.NOTE_OFF), path
+                    assert (event['channel'], event['note'], event['velocity']) == \
+                        (msg.channel, msg.note, msg.velocity), path
+
+                elif msg.type == 'set_tempo':
+                    assert msg.tempo in events.tempo['tempo'], path
+
+        # compare extracted melodies
+        assert np.array_equal(MelodyDataset.midi2melody(midi, 20),
+            MelodyDataset.midi2melody(events, 20)), path
+
+    print('midi decode: {} files, mido {:.2f} s, native {:.2f} s, speedup {:.1f}x'.format(
+        len(paths), t_mido, t_smf, t_mido / t_smf))
+
+
+
+def bench_quantize(dir_path: str, ds: int = 20, grid: int = 4):
+
+    ''' benchmark grid quantization against dense tick roll downsampling
+    (tracks2matrix, matrix2melody)
+
+    Args:
+        dir_path (str): directory of midi files
+        ds (int): tick roll downsampling factor
+        grid (int): grid steps per beat
+    '''
+
+    # get decoded midi files, exclude parse time
+    midi_files = [ smf.read_midi(os.path.join(dir_path, name))
+        for name in sorted(os.listdir(dir_path)) if 'mid' in name[-4:] ]
+
+    t_roll = t_grid = 0.
+    n_roll = n_grid = 0
+
+    for midi in midi_files:
+
+        # dense tick roll baseline, downsampled
+        t = time.perf_counter()
+        melody = MelodyDataset.matrix2melody(
+            MelodyDataset.tracks2matrix(MelodyDataset.midi2tracks(midi)))[::ds]
+        t_roll += time.perf_counter() - t
+        n_roll += len(melody)
+
+        t = time.perf_counter()
+        melody = MelodyDataset.midi2melody(midi, ds, grid = grid)
+        t_grid += time.perf_counter() - t
+        n_grid += len(melody)
+
+    print('quantize: {} files, roll ds={} {:.2f} s ({} steps), grid {}/beat {:.3f} s '
+        '({} steps), speedup {:.0f}x'.format(len(midi_files), ds, t_roll, n_roll,
+        grid, t_grid, n_grid, t_roll / t_grid))
+
+
+
+def bench_memory(dir_path: str, ds: int = 20):
+
+    ''' report bytes per song of melody and note matrix, before (float64 melody,
+    int16 matrix) and after (uint8) compact storage
+
+    Args:
+        dir_path (str): directory of midi files
+        ds (int): tick roll downsampling factor
+    '''
+
+    midi_files = [ smf.read_midi(os.path.join(dir_path, name))
+        for name in sorted(os.listdir(dir_path)) if 'mid' in name[-4:] ]
+
+    melody_bytes = matrix_bytes = frames = cells = 0
+
+    for midi in midi_files:
+
+        matrix = MelodyDataset.tracks2matrix(MelodyDataset.midi2tracks(midi))
+        melody = MelodyDataset.matrix2melody(matrix)[::ds]
+
+        melody_bytes += melody.nbytes
+        matrix_bytes += matrix.nbytes
+        frames += len(melody)
+        cells += matrix.size
+
+    n = len(midi_files)
+
+    print('memory: {} files, bytes per song, melody float64 {:.0f} -> {} {:.0f}, '
+        'matrix int16 {:.0f} -> {} {:.0f}'.format(n, 8 * frames / n, melody.dtype,
+        melody_bytes / n, 2 * cells / n, matrix.dtype, matrix_bytes / n))
+
+
+
+def bench_extract(dir_path: str, ds: int = 20):
+
+    ''' benchmark melody extraction from note intervals against dense roll
+    (tracks2matrix, matrix2melody), check skyline identical to roll, and all
+    policies identical to roll on files with monophonic melody track
+
+    Args:
+        dir_path (str): directory of midi files
+        ds (int): tick roll downsampling factor
+    '''
+
+    midi_files = [ smf.read_midi(os.path.join(dir_path, name))
+        for name in sorted(os.listdir(dir_path)) if 'mid' in name[-4:] ]
+
+    t_roll = t_intervals = 0.
+    n_mono = 0
+
+    for midi in midi_files:
+
+        t = time.perf_counter()
+        ref = MelodyDataset.matrix2melody(
+            MelodyDataset.tracks2matrix(MelodyDataset.midi2tracks(midi)))[::ds]
+        t_roll += time.perf_counter() - t
+
+        t = time.perf_counter()
+        melody = MelodyDataset.midi2melody(midi, ds)
+        t_intervals += time.perf_counter() - t
+
+        assert np.array_equal(ref, melody)
+
+        # melody track frame intervals, monophonic if no two overlap
+        (intervals, _) = MelodyDataset.midi2intervals(midi, ds, n_tracks = 1)
+        (_, starts, stops, _) = intervals[0]
+
+        # non-empty intervals by start
+        (starts, stops) = (starts[starts < stops], stops[starts < stops])
+        order = np.argsort(starts, kind = 'stable')
+        (starts, stops) = (starts[order], stops[order])
+
+        if np.all(starts[1:] >= np.maximum.accumulate(stops)[:-1]):
+
+            # all policies identical to dense roll baseline
+            n_mono += 1
+            for policy in extract.POLICIES:
+                assert np.array_equal(ref, MelodyDataset.midi2melody(midi, ds,
+                    policy = policy)), policy
+
+    n = len(midi_files)
+
+    print('extract: {} files ({} monophonic), roll {:.0f} us/song, intervals {:.0f} '
+        'us/song, speedup {:.0f}x'.format(n, n_mono, 1e6 * t_roll / n,
+        1e6 * t_intervals / n, t_roll / t_intervals))
+
+
+
+def generate_ref(model, n_seqs: int, seq_len: int):
+
+    ''' reference (per-step allocation, autograd enabled) generation loop, cpu '''
+
+    runner = Runner(model)
+
+    bottom_frame_size = model.frame_level_rnns[0].n_frame_samples
+    sequences = torch.LongTensor(n_seqs, model.lookback + seq_len) \
+                     .fill_(utils.q_zero(model.q_levels))
+    frame_level_outputs = [None for _ in model.frame_level_rnns]
+
+    for i in range(model.lookback, model.lookback + seq_len):
+        for (tier_index, rnn) in \
+                reversed(list(enumerate(model.frame_level_rnns))):
+            if i % rnn.n_frame_samples != 0:
+                continue
+
+            prev_samples = 2 * utils.linear_dequantize(
+                sequences[:, i - rnn.n_frame_samples : i], model.q_levels
+            ).unsqueeze(1)
+
+            if tier_index == len(model.frame_level_rnns) - 1:
+                upper_tier_conditioning = None
+            else:
+                frame_index = (i // rnn.n_frame_samples) % \
+                    model.frame_level_rnns[tier_index + 1].frame_size
+                upper_tier_conditioning = \
+                    frame_level_outputs[tier_index + 1][:, frame_index, :] \
+                                       .unsqueeze(1)
+
+            frame_level_outputs[tier_index] = runner.run_rnn(
+                rnn, prev_samples, upper_tier_conditioning
+            )
+
+        prev_samples = sequences[:, i - bottom_frame_size : i]
+        upper_tier_conditioning = \
+            frame_level_outputs[0][:, i % bottom_frame_size, :].unsqueeze(1)
+        sample_dist = model.sample_level_mlp(
+            prev_samples, upper_tier_conditioning
+        ).squeeze(1).exp_().data
+        sequences[:, i] = sample_dist.multinomial(1).squeeze(1)
+
+    return sequences[:, model.lookback :]
+
+
+def bench_generator(n_seqs: int = 16, seq_len: int = 256, frame_sizes: tuple = (4, 4),
+        dim: int = 256, q_levels: int = 128):
+
+    ''' benchmark Generator against reference loop on cpu, check identical samples
+    for same seed
+
+    Args:
+        n_seqs (int): sequences generated in parallel
+        seq_len (int): samples per sequence
+        frame_sizes (tuple): frame size per tier
+        dim (int): model dimension
+        q_levels (int): quantization levels
+    '''
+
+    torch.manual_seed(0)
+    model = SampleRNN(frame_sizes, 1, dim, True, q_levels, True)
+
+    torch.manual_seed(1)
+    t = time.perf_counter()
+    ref = generate_ref(model, n_seqs, seq_len)
+    t_ref = time.perf_counter() - t
+
+    generator = Generator(model, cuda = False, fused = False)
+
+    torch.manual_seed(1)
+    sequences = generator(n_seqs, seq_len)
+
+    assert torch.equal(ref, sequences)
+
+    n = n_seqs * seq_len
+
+    print('generator: {} x {} samples, reference {:.0f} samples/s, generator {:.0f} '
+        'samples/s, speedup {:.1f}x'.format(n_seqs, seq_len, n / t_ref,
+        generator.samples_per_sec, generator.samples_per_sec * t_ref / n))
+
+
+
+def check_kernel_parity(model, n_seqs: int = 4, seq_len: int = 64, atol: float = 1e-5):
+
+    ''' check generation kernel, eager and compiled, against Predictor
+
+    Sample distributions of the kernel (teacher forced on a generated sequence)
+    match Predictor output within atol, and eager and compiled kernels generate
+    identical samples for the same seed. seq_len is a multiple of lookback.
+    '''
+
+    with utils.inference_mode():
+
+        # generate with compiled kernel, eager kernel from same seed
+        results = []
+
+        for script in [True, False]:
+
+            step_kernel = kernel.compile_kernel(model, script)
+
+            sequences = torch.full((n_seqs, model.lookback + seq_len),
+                utils.q_zero(model.q_levels), dtype = torch.long)
+            inputs = 2 * utils.linear_dequantize(sequences, model.q_levels)
+            (hidden, outputs) = kernel.init_state(model, n_seqs)
+
+            torch.manual_seed(0)
+            step_kernel(sequences, inputs, hidden, outputs, model.lookback, seq_len)
+
+            results.append( (step_kernel, sequences, inputs) )
+
+        assert torch.equal(results[0][1], results[1][1])
+
+        # teacher forced distributions against predictor
+        (step_kernel, sequences, inputs) = results[0]
+
+        ref = Predictor(model)(sequences[:, : -1], True).exp()
+        (hidden, outputs) = kernel.init_state(model, n_seqs)
+
+        for j, i in enumerate(range(model.lookback, model.lookback + seq_len)):
+            (sample_dist, hidden, outputs) = step_kernel.step(i, sequences, inputs,
+                hidden, outputs)
+            assert torch.allclose(sample_dist, ref[:, j], atol = atol), i
+
+
+def bench_kernel(n_seqs: int = 16, seq_len: int = 256, frame_sizes: tuple = (4, 4),
+        dim: int = 256, q_levels: int = 128):
+
+    ''' benchmark compiled generation kernel against eager Generator on cpu,
+    check parity (check_kernel_parity)
+    '''
+
+    torch.manual_seed(0)
+    model = SampleRNN(frame_sizes, 1, dim, True, q_levels, True)
+
+    check_kernel_parity(model)
+
+    eager = Generator(model, cuda = False, fused = True)
+    eager(n_seqs, seq_len)
+
+    compiled = Generator(model, cuda = False, compiled = True)
+    compiled(n_seqs, seq_len)
+
+    print('kernel: {} x {} samples, eager {:.0f} samples/s, compiled {:.0f} samples/s, '
+        'speedup {:.1f}x'.format(n_seqs, seq_len, eager.samples_per_sec,
+        compiled.samples_per_sec, compiled.samples_per_sec / eager.samples_per_sec))
+
+
+
+def bench_mlp(n_seqs: int = 16, seq_len: int = 256, frame_sizes: tuple = (4, 4),
+        dim: int = 256, q_levels: int = 128):
+
+    ''' benchmark per-sample Generator latency with sample level mlp lookup table
+    against embedding and input conv, check log-probs match
+    '''
+
+    torch.manual_seed(0)
+    model = SampleRNN(frame_sizes, 1, dim, True, q_levels, True)
+    mlp = model.sample_level_mlp
+
+    # log-probs over random windows, conditioning
+    prev_samples = torch.randint(0, q_levels, (n_seqs, 64 + frame_sizes[0] - 1))
+    conditioning = torch.randn(n_seqs, 64, dim)
+
+    with utils.inference_mode():
+        diff = (mlp(prev_samples, conditioning)
+            - mlp(prev_samples, conditioning, mlp.lookup_table())).abs().max()
+
+    assert diff < 1e-4
+
+    latency = []
+
+    for fused in [False, True]:
+        generator = Generator(model, cuda = False, fused = fused)
+        generator(n_seqs, seq_len)
+        latency.append(1e6 * n_seqs / generator.samples_per_sec)
+
+    print('mlp: {} x {} samples, log-prob max diff {:.1e}, per-step latency conv '
+        '{:.0f} us, table {:.0f} us, speedup {:.2f}x'.format(n_seqs, seq_len, diff,
+        latency[0], latency[1], latency[0] / latency[1]))
+
+
+
+def melody_nll(model, melodies: list, seq_len: int = 64):
+
+    ''' return mean next-note nll (bits) of model over melodies, tbptt chunks '''
+
+    predictor = Predictor(model)
+    lookback = model.lookback
+
+    (total, count) = (0., 0)
+
+    with utils.inference_mode():
+
+        for melody in melodies:
+
+            sequence = torch.from_numpy(np.asarray(melody).astype(np.int64)).unsqueeze(0)
+
+            for begin in range(lookback, sequence.size(1) - seq_len + 1, seq_len):
+
+                chunk = sequence[:, begin - lookback : begin + seq_len]
+                output = predictor(chunk[:, : -1], begin == lookback)
+
+                total += sequence_nll_loss_bits(output, chunk[:, lookback :],
+                    reduction = 'sum').item()
+                count += seq_len
+
+    return total / count
+
+
+def bench_int8(dir_path: str, checkpoint: str = None, frame_sizes: tuple = (4, 4),
+        dim: int = 512, n_files: int = 20, n_seqs: int = 16, seq_len: int = 128):
+
+    ''' compare dynamic int8 quantized model against fp32, next-note nll on
+    held-out melodies (last n_files of directory) and generation throughput
+
+    Args:
+        dir_path (str): directory of midi files
+        checkpoint (str): SampleRNN state dict path, random init if None
+        frame_sizes (tuple), dim (int): model config (n_rnn 1, q_levels 128)
+        n_files (int): held-out melodies
+        n_seqs (int), seq_len (int): generation batch
+    '''
+
+    torch.manual_seed(0)
+    model = SampleRNN(frame_sizes, 1, dim, True, 128, True)
+
+    if checkpoint is not None:
+        model.load_state_dict(torch.load(checkpoint, map_location = 'cpu'))
+
+    quantized = int8.quantize_model(model)
+
+    dataset = MelodyDataset(dir_path, backend = 'native', lazy = True)
+    melodies = [ dataset[index] for index in range(len(dataset))[-n_files:] ]
+
+    nll = [ melody_nll(m, melodies) for m in [model, quantized] ]
+
+    throughput = []
+    for m in [model, quantized]:
+        generator = Generator(m, cuda = False, fused = True)
+        generator(n_seqs, seq_len)
+        throughput.append(generator.samples_per_sec)
+
+    print('int8: {} held-out melodies, nll fp32 {:.4f} int8 {:.4f} bits, generation '
+        'fp32 {:.0f} int8 {:.0f} samples/s, speedup {:.2f}x'.format(len(melodies),
+        nll[0], nll[1], throughput[0], throughput[1], throughput[1] / throughput[0]))
+
+def cold_start(script: str, n: int = 3):
+
+    ''' return min wall time of running python script in fresh process, seconds '''
+
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-W', 'ignore', '-c', script], check = True,
+            cwd = os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def bench_engine(n_seqs: int = 16, seq_len: int = 256, frame_sizes: tuple = (4, 4),
+        dim: int = 512):
+
+    ''' compare numpy engine (engine.NumpyGenerator) against Generator: samples
+    under shared uniform draws, cold start (import, load, generate one short
+    sequence in fresh process) and generation throughput '''
+
+    torch.manual_seed(0)
+    model = SampleRNN(frame_sizes, 1, dim, True, 128, True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        npz_path = os.path.join(tmp_dir, 'model.npz')
+        pt_path = os.path.join(tmp_dir, 'model.pt')
+
+        kernel.export_npz(model, npz_path)
+        torch.save(model.state_dict(), pt_path)
+
+        # same samples given same draws
+        draws = np.random.default_rng(0).random((n_seqs, seq_len), dtype = np.float32)
+
+        generator = Generator(model, cuda = False, fused = True)
+        reference = generator(n_seqs, seq_len, torch.from_numpy(draws)).numpy()
+
+        numpy_generator = engine.NumpyGenerator(npz_path)
+        start = time.perf_counter()
+        samples = numpy_generator(n_seqs, seq_len, draws)
+        numpy_throughput = n_seqs * seq_len / (time.perf_counter() - start)
+
+        assert np.array_equal(samples, reference), 'numpy engine samples differ'
+
+        # cold start, fresh process each
+        numpy_time = cold_start('import engine; engine.NumpyGenerator({!r})(1, 16, seed = 0)'
+            .format(npz_path))
+        torch_time = cold_start('import torch; from model import SampleRNN, Generator; '
+            'm = SampleRNN({!r}, 1, {}, True, 128, True); m.load_state_dict(torch.load({!r})); '
+            'Generator(m, cuda = False, fused = True)(1, 16)'.format(list(frame_sizes), dim, pt_path))
+
+    print('engine: samples identical to Generator under shared draws, cold start numpy '
+        '{:.3f}s torch {:.3f}s ({:.1f}x), generation numpy {:.0f} torch {:.0f} samples/s'
+        .format(numpy_time, torch_time, torch_time / numpy_time, numpy_throughput,
+        generator.samples_per_sec))
+
+def bench_bf16(n_seqs: int = 32, seq_len: int = 256, frame_sizes: tuple = (4, 4),
+        dim: int = 512, n_steps: int = 5):
+
+    ''' compare bfloat16 autocast training (Predictor bf16) against fp32 on the
+    same batch: loss, step time (forward, backward, gradient_clipping Adam step)
+    and activation memory (tensors saved for backward) '''
+
+    torch.manual_seed(0)
+    model = SampleRNN(frame_sizes, 1, dim, True, 128, True)
+    state = {name: value.clone() for name, value in model.state_dict().items()}
+
+    sequences = torch.randint(0, 128, (n_seqs, model.lookback + seq_len), dtype = torch.uint8)
+    (inputs, target) = (sequences[:, : -1], sequences[:, model.lookback :])
+
+    results = {}
+    for bf16 in [False, True]:
+
+        model.load_state_dict(state)
+        predictor = Predictor(model, bf16 = bf16)
+        optimizer = gradient_clipping(torch.optim.Adam(predictor.parameters(), lr = 1e-4))
+
+        # bytes of tensors saved for backward, per step
+        saved = [0]
+
+        def pack(tensor):
+            saved[0] += tensor.numel() * tensor.element_size()
+            return tensor
+
+        def closure():
+            with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+                loss = sequence_nll_loss_bits(predictor(inputs, reset = True), target)
+            loss.backward()
+            return loss
+
+        times = []
+        for _ in range(n_steps):
+            saved[0] = 0
+            start = time.perf_counter()
+            optimizer.zero_grad()
+            loss = optimizer.step(closure)
+            times.append(time.perf_counter() - start)
+
+        results[bf16] = (loss.item(), min(times), saved[0] / 2 ** 20)
+
+    print('bf16: step fp32 {:.3f}s bf16 {:.3f}s ({:.2f}x), activation memory fp32 '
+        '{:.1f} MB bf16 {:.1f} MB, loss after {} steps fp32 {:.4f} bf16 {:.4f} bits'.format(
+        results[False][1], results[True][1], results[False][1] / results[True][1],
+        results[False][2], results[True][2], n_steps, results[False][0], results[True][0]))
+
+
+
+if __name__ == '__main__':
+
+    # default to competition midi data
+    dir_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), '..', 'data', 'comp-data', 'MIDI')
+
+    bench_tracks2matrix(dir_path)
+
+    bench_smf(dir_path)
+
+    bench_quantize(dir_path)
+
+    bench_memory(dir_path)
+
+    bench_extract(dir_path)
+
+    bench_generator()
+
+    bench_kernel()
+
+    bench_mlp()
+
+    bench_int8(dir_path)
+
+    bench_engine()
+
+    bench_bf16()
@@ -0,0 +1,307 @@
+''' imports '''
+
+# filesystem management
+import os
+
+# cache index serialisation
+import json
+
+# file content hashing
+import hashlib
+
+# array handling
+import numpy as np
+
+
+
+# cache format version, stored caches of other versions rebuilt
+CACHE_VERSION = 3
+
+# accompaniment parts cached alongside melody, frame aligned
+PARTS = ['chords', 'bass']
+
+
+class MelodyCache:
+
+    ''' persistent memory-mapped melody cache
+
+    All melodies for given import settings (key, e.g. 'ds20') are stored
+    concatenated in a single .npy file, with a json index of per file offset,
+    length and file key (size, mtime, content hash); cached melodies are
+    returned as views of the read-only memory-mapped array, shared between
+    processes.
+
+    With parts set, chords and bass (see MelodyDataset.midi2parts) are stored
+    likewise in one .npy file per part, with per file part offset and length.
+    '''
+
+    def __init__(self, cache_dir: str, key: str, parts: bool = False):
+
+        ''' init cache, open existing melody (and part) arrays and index if present '''
+
+        # store cache directory, create if needed
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok = True)
+
+        # store import settings key, separate cache files per key
+        self.key = key
+
+        self.data_path = os.path.join(cache_dir, 'melodies-{}.npy'.format(key))
+        self.index_path = os.path.join(cache_dir, 'index-{}.json'.format(key))
+
+        # store parts flag, part array paths
+        self.parts = parts
+        self.part_paths = { part: os.path.join(cache_dir, '{}-{}.npy'.format(part, key))
+            for part in PARTS }
+
+        # init empty index, melody and part arrays, index unchanged since read
+        self.index = {}
+        self.data = None
+        self.part_data = {}
+        self.stored_parts = False
+        self.dirty = False
+
+        # open existing cache, ensure index and arrays all present
+        paths = [ self.index_path, self.data_path ] + \
+            ( list(self.part_paths.values()) if parts else [] )
+
+        if all( os.path.exists(path) for path in paths ):
+
+            with open(self.index_path, 'r') as file:
+                index = json.load(file)
+
+            data = np.load(self.data_path, mmap_mode = 'r')
+
+            # ensure cache built with same import settings and parts, index matches array
+            if index.get('version') == CACHE_VERSION and index.get('key') == key \
+                    and index.get('length') == len(data) \
+                    and (index.get('parts') or not parts):
+
+                self.index = index['files']
+                self.data = data
+                self.stored_parts = bool(index.get('parts'))
+
+                if parts:
+                    self.part_data = { part: np.load(path, mmap_mode = 'r')
+                        for part, path in self.part_paths.items() }
+
+
+    @staticmethod
+    def file_hash(path: str):
+
+        ''' return sha1 hex digest of file content '''
+
+        with open(path, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+
+
+    def file_key(self, path: str):
+
+        ''' return file key (size, mtime, content hash) '''
+
+        stat = os.stat(path)
+
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'hash': self.file_hash(path)}
+
+
+    def valid(self, name: str, path: str):
+
+        ''' check cache entry for file is present and current
+
+        Entry is stale when file size differs; when mtime differs the content hash
+        is compared, so touched but unchanged files remain valid.
+        '''
+
+        entry = self.index.get(name)
+
+        # ensure entry exists
+        if entry is None or self.data is None:
+            return False
+
+        # mark index for write on mtime updated for unchanged content
+        mtime = entry['mtime']
+
+        if file_changed(entry, path):
+            return False
+
+        self.dirty |= entry['mtime'] != mtime
+
+        return True
+
+
+    def get(self, name: str):
+
+        ''' return cached melody view by file name '''
+
+        entry = self.index[name]
+
+        return self.data[entry['offset'] : entry['offset'] + entry['length']]
+
+
+    def get_parts(self, name: str):
+
+        ''' return cached part views by file name '''
+
+        entry = self.index[name]
+        (offset, length) = (entry['part_offset'], entry['part_length'])
+
+        return { part: data[offset : offset + length] for part, data in self.part_data.items() }
+
+
+    def load(self, file_names: list, dir_path: str):
+
+        ''' return cached melody views for files, None where missing or stale;
+        updated mtimes of touched but unchanged files written to index '''
+
+        melodies = [ self.get(name) if self.valid(name, os.path.join(dir_path, name))
+            else None for name in file_names ]
+
+        if self.dirty:
+            self.write_index()
+
+        return melodies
+
+
+    def load_parts(self, file_names: list, dir_path: str):
+
+        ''' return cached part views (dict) for files, None where missing or stale '''
+
+        return [ self.get_parts(name) if self.parts and self.valid(name,
+            os.path.join(dir_path, name)) else None for name in file_names ]
+
+
+    def store(self, file_names: list, dir_path: str, melodies: list, parts: list = None):
+
+        ''' write melodies (and parts) for files to cache, merged with cached
+        entries of other files (e.g. other filtered subsets of directory)
+
+        Args:
+            file_names (list): file names in directory
+            dir_path (str): directory of midi files
+            melodies (list): melody array per file
+            parts (list): dict of part arrays (chords, bass) per file, if cache parts set
+        '''
+
+        # get file keys, reuse stored content hash for unchanged files
+        keys = []
+        for name in file_names:
+
+            path = os.path.join(dir_path, name)
+            stat = os.stat(path)
+            entry = self.index.get(name)
+
+            if entry is not None and entry['size'] == stat.st_size \
+                    and entry['mtime'] == stat.st_mtime_ns:
+                keys.append(entry)
+            else:
+                keys.append(self.file_key(path))
+
+        # keep cached entries of other files, copied from current arrays
+        names = set(file_names)
+        kept = [ name for name in self.index if name not in names ] \
+            if self.data is not None else []
+
+        file_names = list(file_names) + kept
+        keys += [ self.index[name] for name in kept ]
+        melodies = list(melodies) + [ self.get(name) for name in kept ]
+
+        if self.parts:
+            parts = list(parts) + [ self.get_parts(name) for name in kept ]
+
+        # get offset of each melody in concatenated array
+        lengths = [ len(melody) for melody in melodies ]
+        offsets = np.cumsum([0] + lengths)[:-1]
+
+        # concatenate melodies
+        data = np.concatenate(melodies) if len(melodies) else np.zeros(0, dtype = np.uint8)
+
+        # build index
+        index = { name: {'size': key['size'], 'mtime': key['mtime'], 'hash': key['hash'],
+            'offset': int(offset), 'length': int(length)}
+            for name, key, offset, length in zip(file_names, keys, offsets, lengths) }
+
+        # write array via temporary file, replace atomically
+        self.save(self.data_path, data)
+
+        # concatenate, write each part, store part offset and length per file
+        if self.parts:
+
+            part_lengths = [ len(file_parts[PARTS[0]]) for file_parts in parts ]
+            part_offsets = np.cumsum([0] + part_lengths)[:-1]
+
+            for name, offset, length in zip(file_names, part_offsets, part_lengths):
+                index[name]['part_offset'] = int(offset)
+                index[name]['part_length'] = int(length)
+
+            for part, path in self.part_paths.items():
+                self.save(path, np.concatenate([ file_parts[part] for file_parts in parts ])
+                    if len(parts) else np.zeros(0, dtype = np.uint8))
+
+        # reopen memory-mapped arrays, write index last
+        self.index = index
+        self.data = np.load(self.data_path, mmap_mode = 'r')
+        self.stored_parts = self.parts
+
+        self.write_index()
+
+        if self.parts:
+            self.part_data = { part: np.load(path, mmap_mode = 'r')
+                for part, path in self.part_paths.items() }
+
+
+    def write_index(self):
+
+        ''' write index, replace atomically '''
+
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'key': self.key, 'length': len(self.data),
+                'parts': self.stored_parts, 'files': self.index}, file)
+        os.replace(tmp, self.index_path)
+
+        self.dirty = False
+
+
+    @staticmethod
+    def save(path: str, data):
+
+        ''' write array via temporary file, replace atomically '''
+
+        tmp = path + '.tmp.npy'
+        np.save(tmp, data)
+        os.replace(tmp, path)
+
+
+
+def file_changed(entry: dict, path: str):
+
+    ''' check file differs from its key entry (size, mtime, content hash)
+
+    File changed when size differs; when mtime differs the content hash is
+    compared, and for unchanged content the entry mtime is updated in place,
+    so touched but unchanged files are not re-read.
+
+    Args:
+        entry (dict): file key, see MelodyCache.file_key
+        path (str): file path
+
+    Returns:
+        (bool): file changed
+    '''
+
+    stat = os.stat(path)
+
+    # check size, mtime; fall back to content hash on mtime change
+    if entry['size'] != stat.st_size:
+        return True
+
+    if entry['mtime'] != stat.st_mtime_ns:
+
+        if entry['hash'] != MelodyCache.file_hash(path):
+            return True
+
+        # update mtime for unchanged content
+        entry['mtime'] = stat.st_mtime_ns
+
+    return False
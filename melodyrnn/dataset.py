@@ -4,6 +4,16 @@
 # filesystem management
 import os
 
+# shard index serialisation
+import json
+
+# parallel import, failure reporting
+from concurrent.futures import ProcessPoolExecutor
+import warnings
+
+# least recently used melody store
+from collections import OrderedDict
+
 # tensors and nn modules
 import torch
 
@@ -13,91 +23,437 @@ import numpy as np
 # midi file import and parse
 from mido import MidiFile
 
+# native midi decoder, event arrays
+import smf
+
+# grid quantization of note events
+import quantize
+
+# melody extraction from note intervals
+import extract
+
+# run-length token encoding
+import encoding as enc
+
+# melody tensor utilities, transposition
+import utils
+
+# persistent melody cache
+from cache import MelodyCache
+
+# midi corpus metadata index
+from metadata import MidiIndex
+
+
+
+# note event array dtype, as tracks note dicts
+NOTE_DTYPE = np.dtype([
+    ('note', np.uint8),
+    ('time', np.int64),
+    ('velocity', np.uint8),
+])
+
 
 
 class MelodyDataset(torch.utils.data.Dataset):
 
     ''' dataset class for midi files '''
 
-    def __init__(self, dir_path: str, cache = False, ds: int = 20):
-
-        ''' init dataset, import midi files '''
+    def __init__(self, dir_path: str, cache = False, ds: int = 20,
+            cache_dir: str = None, workers: int = 0, lazy: bool = False,
+            max_bytes: int = None, backend: str = 'mido', grid: int = None,
+            unit: str = 'beat', encoding: str = 'frame', n_buckets: int = 8,
+            filters: list = None, index_path: str = None, policy: str = 'skyline',
+            parts: bool = False, keep_path: str = None):
+
+        ''' init dataset, import midi files
+
+        Args:
+            dir_path (str): directory of midi files
+            cache (bool): pre-cache all data on init
+            ds (int): downsampling factor over time
+            cache_dir (str): persistent melody cache directory; cached melodies are
+                memory-mapped without parsing midi, missing or stale entries are
+                imported and stored on init
+            workers (int): number of worker processes for parallel import on init;
+                midi files are parsed in workers only, files which fail to import
+                are reported and excluded from dataset
+            lazy (bool): store midi file paths only, parse on first access; parsed
+                midi files are never held, only imported melodies
+            max_bytes (int): byte budget for imported melodies (and parts) held in
+                memory, least recently used evicted and re-imported on access, over
+                all import paths (access, parallel import); requires lazy, not with
+                cache or cache_dir (all melodies held, memory-mapped); default unbounded
+            backend (str): midi decoder, 'mido' (mido.MidiFile) or 'native' (smf event
+                arrays)
+            grid (int): quantize melody note events directly onto grid of steps per unit
+                (e.g. 4 per beat for 1/16 notes), in place of tick roll downsampling
+            unit (str): grid unit, 'beat' (ticks per beat) or 'second' (tempo map)
+            encoding (str): melody encoding, 'frame' (note per step) or 'rle' (run-length
+                note, duration bucket tokens; see encoding.rle_encode)
+            n_buckets (int): number of rle duration buckets, powers of two
+            filters (list): predicates of file metadata (see metadata.midi_metadata),
+                files included where all hold, e.g. [ lambda meta: meta['n_tracks'] > 3,
+                lambda meta: meta['key'] == 'C' ]
+            index_path (str): persisted metadata index path, only new or changed files
+                read on filter; in memory only if not set
+            policy (str): melody note kept per frame where notes overlap, 'skyline'
+                (highest), 'lowest' or 'longest'; see extract.intervals2melody
+            parts (bool): extract chords and bass with melody in single pass (see
+                midi2parts), cached alongside melody; see get_parts
+            keep_path (str): keep-list of file names (see dedup.dedup), files not
+                listed excluded from dataset
+        '''
 
         super().__init__()
 
-        # store downsampling factor
-        self.ds = ds
+        # byte budget holds for lazily imported melodies only
+        if max_bytes is not None and (not lazy or cache or cache_dir is not None):
+            raise ValueError('max_bytes requires lazy=True, without cache or cache_dir')
 
-        # get and store list midi files in directory
+        # store downsampling factor, quantization grid, midi decoder
+        self.ds = ds
+        self.grid = grid
+        self.unit = unit
+        self.backend = backend
+        self.policy = policy
+        self.parts = parts
+
+        # store melody encoding, number of token levels
+        if encoding not in ['frame', 'rle']:
+            raise ValueError('unknown melody encoding: {}'.format(encoding))
+
+        self.encoding = encoding
+        self.n_buckets = n_buckets
+        self.q_levels = 128 if encoding == 'frame' else enc.rle_levels(n_buckets)
+
+        # store directory, get and store list midi files in directory
+        self.dir_path = dir_path
         self.file_names = [ name for name in os.listdir(dir_path) if 'mid' in name[-4:] ]
 
-        # import and store midi files
-        self.midi_files = [ MidiFile(os.path.join(dir_path, file_name))
-                for file_name in self.file_names ]
+        # filter midi files by metadata index
+        if filters is not None:
+            self.file_names = MidiIndex(index_path).filter(dir_path, self.file_names, filters)
+
+        # exclude files not in keep-list, e.g. near-duplicates
+        if keep_path is not None:
+            with open(keep_path, 'r') as file:
+                keep = set( line.rstrip('\n') for line in file )
+            self.file_names = [ name for name in self.file_names if name in keep ]
+
+        # open persistent melody cache, get cached melodies (None where missing or stale)
+        if cache_dir is not None:
+            key = 'ds{}'.format(ds) if grid is None else 'grid{}-{}'.format(grid, unit)
+            if policy != 'skyline':
+                key += '-{}'.format(policy)
+            if encoding == 'rle':
+                key += '-rle{}'.format(n_buckets)
+            self.melody_cache = MelodyCache(cache_dir, key, parts)
+            cached = self.melody_cache.load(self.file_names, dir_path)
+            cached_parts = self.melody_cache.load_parts(self.file_names, dir_path)
+        else:
+            self.melody_cache = None
+            cached = [ None for _ in range(len(self.file_names)) ]
+            cached_parts = [ None for _ in range(len(self.file_names)) ]
+
+        # import and store midi files, excluding cached; parsed by workers if parallel
+        self.midi_files = [ load_midi(os.path.join(dir_path, file_name), backend)
+                if melody is None and not workers and not lazy else None
+                for file_name, melody in zip(self.file_names, cached) ]
+
+        # store melody byte budget, init usage order of imported melodies (index: bytes)
+        self.max_bytes = max_bytes
+        self.lru = OrderedDict()
+        self.lru_bytes = 0
 
 
-        # case filter by key
-        if False:
+        # init store of import state, from persistent cache where available
+        self.import_list = cached
+        self.parts_list = cached_parts
+        stale = any( melody is None for melody in cached )
 
-            # get index for only midi with meta plus [melody, chords, bass] tracks
-            j = [ i for i in range(len(self.file_names))
-                    if len(self.midi_files[i].tracks) > 3
-                    and "key='{}'".format(key) in str(self.midi_files[i].tracks[0][2]) ]
+        # init store of import failures by file name
+        self.import_errors = {}
 
 
-        if False:
+        # pre-cache all data in parallel worker processes
+        if workers:
+            self.import_parallel(workers)
 
-            # get index for only midi with meta plus [melody, chords, bass] tracks
-            j = [ i for i in range(len(self.file_names))
-                    if len(self.midi_files[i].tracks) > 3 ]
+        # pre-cache all data
+        if cache or self.melody_cache is not None:
 
-            # filter midi file and file name lists
-            self.midi_files = [ self.midi_files[i] for i in j ]
-            self.file_names = [ self.file_names[i] for i in j ]
+            # iterate through midi files not yet imported
+            for index in range(len(self.file_names)):
 
+                if self.import_list[index] is None:
 
-        # init store of import state
-        self.import_list = [ None for _ in range(len(self.midi_files)) ]
+                    # import data to memory
+                    self.import_data(index)
 
+        # update persistent cache on missing or stale entries
+        if self.melody_cache is not None and stale:
 
-        # pre-cache all data
-        if cache:
+            # store all melodies, replace with memory-mapped views
+            self.melody_cache.store(self.file_names, dir_path, self.import_list, self.parts_list)
+            self.import_list = self.melody_cache.load(self.file_names, dir_path)
+            self.parts_list = self.melody_cache.load_parts(self.file_names, dir_path)
 
-            # iterate through midi files
-            for index in range(len(self.file_names)):
+            # release parsed midi files
+            self.midi_files = [ None for _ in range(len(self.file_names)) ]
+
+
+    def import_parallel(self, workers: int):
+
+        ''' import all midi data not yet imported over process pool
+
+        Results are stored in file order; failed files are reported as warning,
+        stored in import_errors, and removed from dataset.
+
+        Args:
+            workers (int): number of worker processes
+        '''
 
-                # import data to memory
-                self.import_data(index)
+        # get index of files not yet imported
+        j = [ i for i in range(len(self.file_names)) if self.import_list[i] is None ]
+
+        # submit import per file to pool
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+
+            futures = [ pool.submit(import_file, os.path.join(self.dir_path,
+                self.file_names[i]), self.ds, self.backend, self.grid, self.unit,
+                self.policy, self.parts) for i in j ]
+
+            # collect results in file order
+            for i, future in zip(j, futures):
+
+                try:
+                    self.store(i, future.result())
+
+                except Exception as e:
+                    self.import_errors[self.file_names[i]] = e
+                    warnings.warn('failed to import {}: {!r}'.format(self.file_names[i], e))
+
+        # remove failed files from dataset
+        if self.import_errors:
+
+            k = [ i for i in range(len(self.file_names))
+                if self.file_names[i] not in self.import_errors ]
+
+            self.file_names = [ self.file_names[i] for i in k ]
+            self.midi_files = [ self.midi_files[i] for i in k ]
+            self.import_list = [ self.import_list[i] for i in k ]
+            self.parts_list = [ self.parts_list[i] for i in k ]
+
+            # reindex tracked melody sizes
+            remap = { i: n for n, i in enumerate(k) }
+            self.lru = OrderedDict( (remap[i], nbytes) for i, nbytes in self.lru.items() )
 
 
     def import_data(self, index):
 
         ''' import midi data to memory '''
 
-        # get midi by index
+        # get midi by index, parse from file if not held
         midi = self.midi_files[index]
+        if midi is None:
+            midi = load_midi(os.path.join(self.dir_path, self.file_names[index]), self.backend)
 
-        # get midi tracks
-        tracks = self.midi2tracks(midi)
+        # extract melody, or all parts in single pass
+        if self.parts:
+            result = self.midi2parts(midi, self.ds, self.grid, self.unit, self.policy)
+        else:
+            result = self.midi2melody(midi, self.ds, self.grid, self.unit, self.policy)
 
-        # get note tracks matrix
-        matrix = self.tracks2matrix(tracks)
+        self.store(index, result)
+
+
+    def store(self, index, result):
+
+        ''' store imported melody (encoded) in import list, or parts dict in part
+        list; all import paths store here, size tracked against byte budget '''
+
+        if not self.parts:
+            self.import_list[index] = self.encode(result)
+        else:
+            self.import_list[index] = self.encode(result['melody'])
+            self.parts_list[index] = {'chords': result['chords'], 'bass': result['bass']}
+
+        if self.max_bytes is not None:
+            self.track(index)
+
+
+    def track(self, index):
+
+        ''' track size of stored melody (and parts), evict least recently used
+        melodies over byte budget, excl. most recent '''
+
+        if index in self.lru:
+            self.lru_bytes -= self.lru.pop(index)
+
+        self.lru[index] = self.import_list[index].nbytes + sum( part.nbytes
+            for part in (self.parts_list[index] or {}).values() )
+        self.lru_bytes += self.lru[index]
+
+        while self.lru_bytes > self.max_bytes and len(self.lru) > 1:
+            (j, nbytes) = self.lru.popitem(last = False)
+            self.import_list[j] = None
+            self.parts_list[j] = None
+            self.lru_bytes -= nbytes
+
+
+    def get_parts(self, index):
+
+        ''' return chords and bass of midi file, frame aligned with decoded melody
+
+        Returns:
+            (dict): chords (T, 16) packed note roll [uint8], bass (T,) [uint8]
+        '''
+
+        if not self.parts:
+            raise ValueError('dataset not initialised with parts')
+
+        # import melody and parts if not held
+        if self.parts_list[index] is None:
+            self[index]
+
+        return self.parts_list[index]
+
+
+    def encode(self, melody):
+
+        ''' encode frame melody by dataset encoding '''
+
+        if self.encoding == 'rle':
+            return enc.rle_encode(melody, self.n_buckets)
+
+        return melody
+
+
+    def decode(self, melody):
+
+        ''' decode melody by dataset encoding to frame melody '''
+
+        if self.encoding == 'rle':
+            return enc.rle_decode(melody, self.n_buckets)
+
+        return melody
+
+
+    @staticmethod
+    def midi2intervals(midi, ds: int, grid: int = None, unit: str = 'beat',
+            n_tracks: int = 3):
+
+        ''' extract note intervals over melody frames from tracks of midi
+
+        Frames are grid points if grid set (see quantize.quantize_intervals), else
+        every ds roll columns (as tracks2matrix, melody[::ds]); note intervals are
+        mapped directly to frames, without dense roll.
+
+        Args:
+            midi (mido.MidiFile or smf.MidiEvents): midi file
+            ds (int): downsampling factor over time
+            grid (int): grid steps per unit
+            unit (str): grid unit, 'beat' or 'second'
+            n_tracks (int): number of tracks, [melody, chords, bass]
+
+        Returns:
+            (list): note, start, stop, value arrays per track (up to n_tracks)
+            (int): melody length, frames
+        '''
 
-        # get melody format from matrix
-        melody = self.matrix2melody(matrix)
+        # quantize note events of each track onto grid, melody track length
+        if grid is not None:
 
+            ts = [0] if len(midi.tracks) == 1 else range(len(midi.tracks))[1:4]
 
-        # downsample over time
-        melody = melody[::self.ds]
+            quantized = [ quantize.quantize_intervals(midi, i, grid, unit)
+                for i in list(ts)[:n_tracks] ]
 
+            return [ q[0] for q in quantized ], quantized[0][1]
 
-        # store matrix in import list
-        self.import_list[index] = melody
+        # get midi track note events
+        events = [ MelodyDataset.track2events(track)
+            for track in MelodyDataset.midi2tracks(midi) ]
 
+        # get max track length (zero init column plus total time)
+        length = max([ 1 + int(times.sum()) for (_, times, _) in events ])
 
-    def midi2tracks(self, midi):
+        intervals = []
 
-        ''' extract tracks from mido.MidiFile '''
+        for (notes, times, values) in events[:n_tracks]:
+
+            # get note intervals, state applies from column after time
+            (notes, starts, stops, values) = extract.events2intervals(
+                np.cumsum(times) + 1, notes, values, length)
+
+            # map intervals to downsampled frames (column k * ds), by ceil division
+            intervals.append( (notes, -(-starts // ds), -(-stops // ds), values) )
+
+        return intervals, -(-length // ds)
+
+
+    @staticmethod
+    def midi2melody(midi, ds: int, grid: int = None, unit: str = 'beat',
+            policy: str = 'skyline'):
+
+        ''' extract downsampled melody from mido.MidiFile or smf.MidiEvents
+
+        Melody quantized directly onto grid if set, else sampled every ds roll
+        columns (as tracks2matrix, matrix2melody, melody[::ds]); see midi2intervals.
+
+        Args:
+            midi (mido.MidiFile or smf.MidiEvents): midi file
+            ds (int): downsampling factor over time
+            grid (int): grid steps per unit, see quantize.quantize_melody
+            unit (str): grid unit, 'beat' or 'second'
+            policy (str): active note kept per frame, see extract.POLICIES
+        '''
+
+        # get melody track note intervals
+        (intervals, length) = MelodyDataset.midi2intervals(midi, ds, grid, unit, 1)
+        (notes, starts, stops, _) = intervals[0]
+
+        # return melody
+        return extract.intervals2melody(notes, starts, stops, length, policy)
+
+
+    @staticmethod
+    def midi2parts(midi, ds: int, grid: int = None, unit: str = 'beat',
+            policy: str = 'skyline'):
+
+        ''' extract melody, chords and bass from midi in single pass
+
+        Parts are frame aligned with melody (as midi2melody); chords as 128-bit
+        packed note roll (see extract.intervals2roll), bass lowest note per frame.
+        Missing tracks give silent parts.
+
+        Returns:
+            (dict): melody (T,) [uint8], chords (T, 16) [uint8], bass (T,) [uint8]
+        '''
+
+        # get note intervals of [melody, chords, bass] tracks
+        (intervals, length) = MelodyDataset.midi2intervals(midi, ds, grid, unit, 3)
+
+        # silent parts for missing tracks
+        empty = tuple( np.zeros(0, dtype = np.int64) for _ in range(4) )
+        intervals += [ empty ] * (3 - len(intervals))
+
+        return {
+            'melody': extract.intervals2melody(*intervals[0][:3], length, policy),
+            'chords': extract.intervals2roll(*intervals[1][:3], length),
+            'bass': extract.intervals2melody(*intervals[2][:3], length, 'lowest'),
+        }
+
+
+    @staticmethod
+    def midi2tracks(midi):
+
+        ''' extract tracks from mido.MidiFile or smf.MidiEvents
+
+        Tracks from mido.MidiFile are lists of note dicts (note, time, velocity);
+        from smf.MidiEvents, arrays of note events with the same fields.
+        '''
 
         # initialise tracks list
         tracks = []
@@ -107,6 +463,25 @@ class MelodyDataset(torch.utils.data.Dataset):
         else:
             ts = range(len(midi.tracks))[1:4]
 
+        # native decoded events, select note events per track
+        if isinstance(midi, smf.MidiEvents):
+
+            for i in ts:
+
+                events = midi.tracks[i]
+
+                # get note events, note off as zero velocity (note on zero velocity kept)
+                j = (events['type'] == smf.NOTE_ON) | (events['type'] == smf.NOTE_OFF)
+
+                track = np.empty(j.sum(), dtype = NOTE_DTYPE)
+                track['note'] = events['note'][j]
+                track['time'] = events['time'][j]
+                track['velocity'] = events['type'][j] == smf.NOTE_ON
+
+                tracks.append(track)
+
+            return tracks
+
         # iterate over tracks in midi (excl. meta track, extra), [melody, chords, bass]
         #for i in range(len(midi.tracks))[1:4]:
         for i in ts:
@@ -141,53 +516,75 @@ class MelodyDataset(torch.utils.data.Dataset):
         return tracks
 
 
-    def tracks2matrix(self, tracks: list):
+    @staticmethod
+    def track2events(track):
 
-        ''' convert tracks to matrix '''
+        ''' get note, time delta, value arrays from track
 
-        # initialise track matricies list
-        m = []
+        Args:
+            track: list of note dicts (note, time, velocity) or note event array
 
-        # iterate tracks
-        for track in tracks:
+        Returns:
+            (np.array): note per event [int64]
+            (np.array): time delta per event [int64]
+            (np.array): value per event [uint8]
+        '''
 
-            # initialise note state vector, 7-bit note depth
-            N = np.zeros(128, dtype = np.int16)
+        # from track events
+        if isinstance(track, np.ndarray):
+            return (track['note'].astype(np.int64), track['time'].astype(np.int64),
+                track['velocity'].astype(np.uint8))
 
-            # initialise track note matrix (zero init column)
-            M = np.zeros((128, 1), dtype = np.int16)
+        # else from track messages
+        return (np.array([ int(msg['note']) for msg in track ], dtype = np.int64),
+            np.array([ int(msg['time']) for msg in track ], dtype = np.int64),
+            np.array([ int(msg['velocity']) for msg in track ], dtype = np.uint8))
 
-            # iterate messages in track
-            for msg in track:
 
-                # if time step changes, store intermediate notes
-                if int(msg['time']) != 0:
+    @staticmethod
+    def tracks2matrix(tracks: list):
 
-                    # extend note state vector over range time step
-                    n = np.stack([ N for _ in range( int(msg['time']) ) ]).T
+        ''' convert tracks to matrix
+
+        Note events are converted in a single pass per track; message delta times
+        are accumulated to absolute columns, and each note state is filled as a
+        span up to the next event for the same note, into preallocated matrix.
+
+        Args:
+            tracks (list): list of tracks, each list of note dicts (note, time, velocity)
+                or note event array [NOTE_DTYPE]
+
+        Returns:
+            (np.array): stacked tracks note matrix, shape (128, T, tracks) [uint8]
+        '''
 
-                    # append note state vector to track note matrix
-                    M = np.concatenate( [M, n], axis = 1 )
+        # get note event arrays per track
+        events = [ MelodyDataset.track2events(track) for track in tracks ]
 
-                # update value of note vector by index
-                N[int(msg['note'])] = int(msg['velocity'])
+        # get track lengths (zero init column plus total time), max length track
+        lengths = [ 1 + int(times.sum()) for (_, times, _) in events ]
+        s = max(lengths)
 
-            # store track note matrix
-            m.append(M)
+        # initialise stacked tracks note matrix, zero padded to max length
+        M = np.zeros((128, s, len(tracks)), dtype = np.uint8)
 
+        # iterate tracks
+        for k, (notes, times, values) in enumerate(events):
 
-        # get max length track
-        s = max([ track.shape[1] for track in m ])
+            # get note state spans, state applies from column after time
+            intervals = extract.events2intervals(np.cumsum(times) + 1, notes, values,
+                lengths[k])
 
-        # pad tracks to max length of time axis, stack on new axis
-        M = np.stack([ np.pad(track, ((0, 0), (0, s - track.shape[1])))
-            for track in m ], axis = 2)
+            # fill each non-zero note state span
+            for n, a, b, v in zip(*[ x.tolist() for x in intervals ]):
+                M[n, a:b, k] = v
 
         # return stacked tracks note matrix
         return M
 
 
-    def matrix2melody(self, matrix):
+    @staticmethod
+    def matrix2melody(matrix):
 
         ''' extract melody from note matrix '''
 
@@ -197,7 +594,7 @@ class MelodyDataset(torch.utils.data.Dataset):
         # init zero melody, default negative one
         #melody = np.ones(M.shape[1])*-1
 
-        melody = np.zeros(M.shape[1])
+        melody = np.zeros(M.shape[1], dtype = np.uint8)
 
         # get index (note, time) where nonzero
         j = np.where( M != 0 )
@@ -219,6 +616,10 @@ class MelodyDataset(torch.utils.data.Dataset):
             # import data to memory
             self.import_data(index)
 
+        # mark most recently used
+        if self.max_bytes is not None and index in self.lru:
+            self.lru.move_to_end(index)
+
 
         # return data if already imported
         return self.import_list[index]
@@ -249,29 +650,575 @@ class MelodyDataset(torch.utils.data.Dataset):
         return len(self.file_names)
 
 
+    def lengths(self):
+
+        ''' return melody length per midi file, imports all data '''
+
+        return [ len(self[index]) for index in range(len(self)) ]
+
+
+
+def load_midi(path: str, backend: str = 'mido'):
+
+    ''' load midi file by decoder backend, 'mido' or 'native' '''
+
+    if backend == 'native':
+        return smf.read_midi(path)
+
+    if backend == 'mido':
+        return MidiFile(path)
+
+    raise ValueError('unknown midi backend: {}'.format(backend))
+
+
+def import_file(path: str, ds: int, backend: str = 'mido', grid: int = None,
+        unit: str = 'beat', policy: str = 'skyline', parts: bool = False):
+
+    ''' import downsampled melody (or parts) from midi file path, for process pool workers '''
+
+    if parts:
+        return MelodyDataset.midi2parts(load_midi(path, backend), ds, grid, unit, policy)
+
+    return MelodyDataset.midi2melody(load_midi(path, backend), ds, grid, unit, policy)
+
+
+
+
+def buffer_shuffle(order, buffer_size: int, rng):
+
+    ''' shuffle index stream within bounded buffer
+
+    Indices fill buffer in stream order; once full, a random buffered index is
+    emitted and replaced by the next, remaining buffer emitted shuffled at end.
+    Index only, so order is computed without reading items.
+
+    Args:
+        order (np.array): index stream
+        buffer_size (int): shuffle buffer size, no shuffle if < 2
+        rng (np.random.Generator): random generator
+
+    Returns:
+        (np.array): shuffled index stream
+    '''
+
+    if buffer_size < 2:
+        return np.asarray(order)
+
+    order = np.asarray(order)
+    out = np.empty_like(order)
+    buffer = list(order[:buffer_size])
+
+    # draw all replacement positions at once
+    picks = rng.integers(0, len(buffer), max(len(order) - len(buffer), 0))
+
+    for i, (j, index) in enumerate(zip(picks.tolist(), order[buffer_size:].tolist())):
+        out[i] = buffer[j]
+        buffer[j] = index
+
+    # emit remaining buffer shuffled
+    out[len(order) - len(buffer):] = rng.permutation(np.asarray(buffer, dtype = order.dtype))
+
+    return out
+
+
+
+class MelodyStream(torch.utils.data.IterableDataset):
+
+    ''' streaming dataset of melodies from midi directory or melody shards
+
+    Songs are read on demand, never held; only the song index stream is kept.
+    Each epoch the source order (midi files, or shards with songs in shard
+    order) is permuted and shuffled within a bounded buffer (buffer_shuffle),
+    seeded by (seed, epoch), so the song sequence of an epoch is deterministic.
+
+    Loader workers (get_worker_info) take alternate blocks of block_size songs
+    of the sequence, so round-robin batches of block_size (DataLoader default
+    in_order) yield the sequence in order, for any number of workers. Iteration
+    starts at the (epoch, offset) cursor, offset counted in songs of the
+    sequence; see state_dict, advance.
+    '''
+
+    def __init__(self, path: str, ds: int = 20, backend: str = 'native',
+            grid: int = None, unit: str = 'beat', policy: str = 'skyline',
+            encoding: str = 'frame', n_buckets: int = 8, buffer_size: int = 0,
+            shuffle: bool = True, seed: int = 0, block_size: int = 1):
+
+        ''' init stream, list source files
+
+        Args:
+            path (str): directory of midi files, or of melody shards (shard-*.npy,
+                see write_shards)
+            ds, backend, grid, unit, policy, encoding, n_buckets: import settings,
+                as MelodyDataset; shards store encoded melodies as written
+            buffer_size (int): shuffle buffer size, songs
+            shuffle (bool): permute sources and shuffle within buffer each epoch
+            seed (int): base seed of epoch order
+            block_size (int): consecutive songs per worker block, loader batch size
+        '''
+
+        super().__init__()
+
+        # store import settings
+        self.ds = ds
+        self.backend = backend
+        self.grid = grid
+        self.unit = unit
+        self.policy = policy
+
+        if encoding not in ['frame', 'rle']:
+            raise ValueError('unknown melody encoding: {}'.format(encoding))
+
+        self.encoding = encoding
+        self.n_buckets = n_buckets
+        self.q_levels = 128 if encoding == 'frame' else enc.rle_levels(n_buckets)
+
+        # store order settings, init cursor
+        self.buffer_size = buffer_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.block_size = block_size
+        self.epoch = 0
+        self.offset = 0
+
+        # list melody shards, sorted for deterministic order
+        self.path = path
+        names = sorted(os.listdir(path))
+        self.shard_names = [ name for name in names
+            if name.startswith('shard-') and name.endswith('.npy') ]
+
+        # shards: song offsets, lengths per shard from json index
+        if self.shard_names:
+
+            self.shard_index = []
+
+            for name in self.shard_names:
+                with open(os.path.join(path, name[:-4] + '.json'), 'r') as file:
+                    self.shard_index.append(json.load(file))
+
+            self.sizes = [ len(index['lengths']) for index in self.shard_index ]
+
+            # source file name per song, shard order
+            self.file_names = [ name for index in self.shard_index for name in index['names'] ]
+
+        # midi directory: one song per file
+        else:
+            self.file_names = [ name for name in names if 'mid' in name[-4:] ]
+            self.sizes = [ 1 for _ in self.file_names ]
+
+        # first song index per source
+        self.starts = np.cumsum([0] + self.sizes)
+
+        # memory-mapped shards opened per process
+        self.shards = {}
+
+
+    def __len__(self):
+
+        ''' return total songs '''
+
+        return int(self.starts[-1])
+
+
+    def order(self, epoch: int):
+
+        ''' return song index sequence of epoch '''
+
+        if not self.shuffle:
+            return np.arange(len(self))
+
+        rng = np.random.default_rng((self.seed, epoch))
+
+        # permute sources, songs of each source in order
+        sources = rng.permutation(len(self.sizes))
+        order = np.concatenate([ np.arange(self.starts[i], self.starts[i + 1])
+            for i in sources ] + [ np.zeros(0, dtype = np.int64) ])
+
+        return buffer_shuffle(order, self.buffer_size, rng)
+
+
+    def read(self, index: int):
+
+        ''' read encoded melody by song index '''
+
+        # midi file, import melody
+        if not self.shard_names:
+
+            melody = import_file(os.path.join(self.path, self.file_names[index]), self.ds,
+                self.backend, self.grid, self.unit, self.policy)
+
+            return enc.rle_encode(melody, self.n_buckets) if self.encoding == 'rle' else melody
+
+        # shard, view of memory-mapped array
+        k = int(np.searchsorted(self.starts, index, side = 'right')) - 1
+
+        if k not in self.shards:
+            self.shards[k] = np.load(os.path.join(self.path, self.shard_names[k]),
+                mmap_mode = 'r')
+
+        entry = self.shard_index[k]
+        (offset, length) = (entry['offsets'][index - self.starts[k]],
+            entry['lengths'][index - self.starts[k]])
+
+        return self.shards[k][offset : offset + length]
+
+
+    def __iter__(self):
+
+        ''' yield melodies of epoch from cursor, alternate blocks per worker '''
+
+        info = torch.utils.data.get_worker_info()
+        (worker, n_workers) = (info.id, info.num_workers) if info is not None else (0, 1)
+
+        # song sequence of epoch from cursor
+        order = self.order(self.epoch)[self.offset:]
+
+        # alternate blocks of block_size songs per worker
+        blocks = range(worker * self.block_size, len(order), n_workers * self.block_size)
+
+        for start in blocks:
+            for index in order[start : start + self.block_size].tolist():
+                yield self.read(index)
+
+
+    def advance(self, n: int):
+
+        ''' advance cursor by n consumed songs, next epoch at end '''
+
+        self.offset += n
+
+        if self.offset >= len(self):
+            self.set_epoch(self.epoch + 1)
+
+
+    def set_epoch(self, epoch: int):
+
+        ''' set cursor to start of epoch '''
+
+        self.epoch = epoch
+        self.offset = 0
+
+
+    def state_dict(self):
+
+        ''' return resume cursor '''
+
+        return {'epoch': self.epoch, 'offset': self.offset}
+
+
+    def load_state_dict(self, state: dict):
+
+        ''' resume from cursor '''
+
+        self.epoch = state['epoch']
+        self.offset = state['offset']
+
+
+    def write_shards(self, out_dir: str, shard_size: int = 1024):
+
+        ''' import midi directory (or re-shard melody shards) to melody shards, in
+        file (shard) order
+
+        Each shard stores shard_size encoded melodies concatenated as .npy, with
+        json index of file names, offsets and lengths.
+
+        Args:
+            out_dir (str): shard directory, other than source directory
+            shard_size (int): songs per shard
+        '''
+
+        # source shards are read while written
+        if os.path.exists(out_dir) and os.path.samefile(out_dir, self.path):
+            raise ValueError('shard directory is source directory: {}'.format(out_dir))
+
+        os.makedirs(out_dir, exist_ok = True)
+
+        for k, i in enumerate(range(0, len(self), shard_size)):
+
+            names = self.file_names[i : i + shard_size]
+            melodies = [ self.read(index) for index in range(i, i + len(names)) ]
+
+            lengths = [ len(melody) for melody in melodies ]
+            offsets = np.cumsum([0] + lengths)[:-1]
+
+            # write array then index, index marks complete shard
+            np.save(os.path.join(out_dir, 'shard-{:05d}.npy'.format(k)), np.concatenate(
+                melodies) if melodies else np.zeros(0, dtype = np.uint8))
+
+            with open(os.path.join(out_dir, 'shard-{:05d}.json'.format(k)), 'w') as file:
+                json.dump({'names': names, 'offsets': offsets.tolist(),
+                    'lengths': lengths}, file)
+
+
+# target value for padded steps, ignored by nll loss (default ignore_index)
+PAD_TARGET = -100
+
+
+def pad_collate(batch):
+
+    ''' collate melodies of varying length, pad with silence (zero)
+
+    Args:
+        batch (list): melody arrays
+
+    Returns:
+        (torch.Tensor): padded melodies, shape (batch, max length), melody dtype
+        (torch.Tensor): melody lengths [long]
+    '''
+
+    lengths = [ len(melody) for melody in batch ]
+
+    # fill zero padded array of melody dtype, single conversion to tensor
+    dtype = np.result_type(*[ np.asarray(melody).dtype for melody in batch ])
+    padded = np.zeros((len(batch), max(lengths)), dtype = dtype)
+
+    for i, melody in enumerate(batch):
+        padded[i, :lengths[i]] = melody
+
+    return torch.from_numpy(padded), torch.tensor(lengths)
+
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+
+    ''' batch sampler grouping melodies of similar length
+
+    Indices are shuffled, split into pools of bucket_size batches, sorted by
+    length within each pool and split into batches; batch order is shuffled.
+    '''
+
+    def __init__(self, lengths: list, batch_size: int, bucket_size: int = 16,
+            shuffle: bool = True, drop_last: bool = False):
+
+        ''' init sampler
+
+        Args:
+            lengths (list): melody length per dataset index
+            batch_size (int): melodies per batch
+            bucket_size (int): batches per length sorted pool
+            shuffle (bool): shuffle pools and batch order each epoch
+            drop_last (bool): drop last incomplete batch of each pool
+        '''
+
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+
+    def __iter__(self):
+
+        index = np.random.permutation(len(self.lengths)) if self.shuffle \
+            else np.arange(len(self.lengths))
+
+        # split index into pools, sort each pool by length
+        pool_size = self.batch_size * self.bucket_size
+
+        batches = []
+        for i in range(0, len(index), pool_size):
+
+            pool = index[i : i + pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind = 'stable')]
+
+            batches += [ pool[j : j + self.batch_size].tolist()
+                for j in range(0, len(pool), self.batch_size)
+                if not self.drop_last or j + self.batch_size <= len(pool) ]
+
+        # shuffle batch order
+        if self.shuffle:
+            batches = [ batches[i] for i in np.random.permutation(len(batches)) ]
+
+        return iter(batches)
+
+
+    def __len__(self):
+
+        pool_size = self.batch_size * self.bucket_size
+        (full, rest) = divmod(len(self.lengths), pool_size)
+
+        if self.drop_last:
+            return full * self.bucket_size + rest // self.batch_size
+
+        return full * self.bucket_size + -(-rest // self.batch_size)
+
+
 
 class MelodyDataLoader(torch.utils.data.DataLoader):
 
+    ''' data loader yielding truncated backprop through time chunks
+
+    With bucket set, melodies of similar length are batched together
+    (BucketBatchSampler) and padded with silence (pad_collate); padded target
+    steps are set to PAD_TARGET (targets int16), and chunks with only padded
+    targets skipped.
+
+    With chunked set, all melodies are stored once as a single contiguous
+    compact tensor (each melody led by overlap_len silence), split into
+    batch_size * stream_groups parallel streams; chunks are strided (unfold)
+    views over the streams. Each epoch, streams run in stream_groups groups of
+    batch_size, hidden state reset at the start of each group; with shuffle
+    set, streams are permuted across groups per epoch (melody order shuffled
+    once on build), without re-collating the corpus; chunks of one group in
+    order are views, otherwise each chunk is gathered in one copy (into pinned
+    memory when streams are pinned). Streams are a copy of the
+    corpus held by the loader, outside the dataset max_bytes budget.
+
+    Chunks are yielded in melody dtype (uint8 for 7-bit notes), widened to long
+    on device by Predictor and sequence_nll_loss_bits.
+
+    With transpose set, each melody (row) is transposed by a random semitone
+    shift in [-transpose, transpose], constant over its chunks (chunked, per
+    stream group); silence preserved.
+
+    With MelodyStream dataset, melodies are padded (pad_collate) and worker
+    blocks set to batch_size; the stream cursor is advanced by each batch once
+    all its chunks are yielded, so state_dict of the stream resumes after the
+    last complete batch.
+    '''
+
     def __init__(self, dataset, batch_size, seq_len, overlap_len,
-                 *args, **kwargs):
+                 *args, bucket_size: int = None, chunked: bool = False,
+                 stream_groups: int = 1, device = None, transpose: int = 0,
+                 **kwargs):
+
+        # length bucketed batches, padded collate
+        if bucket_size is not None:
+
+            kwargs['batch_sampler'] = BucketBatchSampler(dataset.lengths(), batch_size,
+                bucket_size, kwargs.pop('shuffle', True), kwargs.pop('drop_last', False))
+            kwargs.setdefault('collate_fn', pad_collate)
+
+            batch_size = 1
+
+        # streamed melodies of varying length, padded collate, worker blocks of one batch
+        if isinstance(dataset, MelodyStream):
+            kwargs.setdefault('collate_fn', pad_collate)
+            dataset.block_size = batch_size
 
         super().__init__(dataset, batch_size, *args, **kwargs)
 
         self.seq_len = seq_len
         self.overlap_len = overlap_len
 
+        # transposition augmentation, note field of rle tokens
+        self.transpose = transpose
+        self.n_buckets = dataset.n_buckets \
+            if getattr(dataset, 'encoding', 'frame') == 'rle' else 1
+
+        # pre-chunked streams of compact melody storage
+        self.chunked = chunked
+        self.stream_groups = stream_groups
+        self.device = device
+
+        if chunked:
+            self.shuffle = kwargs.get('shuffle', False)
+            self.build_streams()
+
+    def build_streams(self):
+
+        ''' store melodies once as batch_size * stream_groups contiguous streams,
+        chunk window views '''
+
+        melodies = [ self.dataset[index] for index in range(len(self.dataset)) ]
+
+        # shuffle melody order once, streams are permuted per epoch
+        if self.shuffle:
+            melodies = [ melodies[i] for i in np.random.permutation(len(melodies)) ]
+
+        # compact dtype by max level
+        levels = getattr(self.dataset, 'q_levels', 128)
+        dtype = np.uint8 if levels <= 256 else np.int16
+
+        # concatenate melodies, each led by silence over overlap
+        lead = np.zeros(self.overlap_len, dtype = dtype)
+        stream = np.concatenate([ part for melody in melodies
+            for part in (lead, np.asarray(melody).astype(dtype)) ])
+
+        # split into rows, pin for async device transfer
+        n_streams = self.batch_size * self.stream_groups
+        length = len(stream) // n_streams
+        self.streams = torch.from_numpy(stream[: n_streams * length]) \
+            .view(n_streams, length)
+
+        if self.device is not None and torch.device(self.device).type == 'cuda':
+            self.streams = self.streams.pin_memory()
+
+        # overlapping chunk windows as strided view, (stream, chunk, overlap + seq_len)
+        self.windows = self.streams.unfold(1, self.overlap_len + self.seq_len, self.seq_len)
+
+    def iter_chunks(self):
+
+        ''' yield chunks from strided window views, batch_size streams per group '''
+
+        # permute streams per epoch, no re-collation
+        n_streams = self.windows.size(0)
+        order = torch.randperm(n_streams) if self.shuffle else torch.arange(n_streams)
+
+        for group in order.view(self.stream_groups, self.batch_size):
+
+            # random semitone shift per stream of group
+            shifts = torch.randint(-self.transpose, self.transpose + 1, (self.batch_size,))
+
+            # all rows in order as plain view, else gather of group rows per chunk
+            gather = self.stream_groups > 1 or self.shuffle
+
+            for k in range(self.windows.size(1)):
+
+                # get chunk window, gathered in one copy into pinned memory if streams
+                # pinned (fresh buffer per chunk, not reused while transfer pending)
+                window = self.windows[:, k]
+                if gather:
+                    window = torch.index_select(window, 0, group, out = torch.empty(
+                        (self.batch_size, window.size(1)), dtype = window.dtype,
+                        pin_memory = self.streams.is_pinned()))
+
+                # transfer to device, asynchronous from pinned memory
+                if self.device is not None:
+                    window = window.to(self.device, non_blocking = True)
+
+                # transpose on device
+                if self.transpose:
+                    window = utils.transpose(window, shifts, self.n_buckets)
+
+                # inputs and targets as views of window
+                input_sequences = window[:, : -1]
+                target_sequences = window[:, self.overlap_len :]
+
+                yield (input_sequences, k == 0, target_sequences)
+
     def __iter__(self):
 
+        if self.chunked:
+            yield from self.iter_chunks()
+            return
+
+        stream = self.dataset if isinstance(self.dataset, MelodyStream) else None
+        epoch = stream.epoch if stream is not None else None
+
         for batch in super().__iter__():
 
+            # padded batch with melody lengths
+            if isinstance(batch, (tuple, list)):
+                (batch, lengths) = batch
+            else:
+                lengths = None
+
             (batch_size, n_samples) = batch.size()
 
+            # transpose each melody by random shift
+            if self.transpose:
+                batch = utils.random_transpose(batch, self.transpose, self.n_buckets)
+
             reset = True
 
             #print(self.overlap_len, n_samples, self.seq_len)
 
             for seq_begin in range(self.overlap_len, n_samples, self.seq_len)[:-1]:
 
+                # stop at first chunk with only padded targets
+                if lengths is not None and not (lengths > seq_begin).any():
+                    break
+
                 from_index = seq_begin - self.overlap_len
 
                 to_index = seq_begin + self.seq_len
@@ -284,11 +1231,32 @@ class MelodyDataLoader(torch.utils.data.DataLoader):
 
                 target_sequences = sequences[:, self.overlap_len :].contiguous()
 
+                # mask padded target steps
+                if lengths is not None:
+                    target_sequences = target_sequences.to(torch.int16).masked_fill(
+                        seq_begin + torch.arange(target_sequences.size(1))
+                        >= lengths.unsqueeze(1), PAD_TARGET)
+
                 yield (input_sequences, reset, target_sequences)
 
                 reset = False
 
+            # advance stream cursor past complete batch
+            if stream is not None:
+                stream.advance(batch_size)
+
+        # next epoch of stream, incl. dropped last batch
+        if stream is not None and stream.epoch == epoch:
+            stream.set_epoch(epoch + 1)
+
 
     def __len__(self):
-        raise NotImplementedError()
+
+        ''' return number of chunks per epoch, pre-chunked only; chunks of other
+        modes depend on lengths of the melodies batched per epoch '''
+
+        if not self.chunked:
+            raise TypeError('MelodyDataLoader has a length with chunked=True only')
+
+        return self.stream_groups * self.windows.size(1)
 
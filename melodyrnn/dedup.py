@@ -0,0 +1,247 @@
+''' imports '''
+
+# filesystem management
+import os
+import sys
+
+# array handling
+import numpy as np
+
+# midi dataset
+from dataset import MelodyDataset
+
+
+
+# mersenne prime modulus of minhash permutations, products fit in uint64
+PRIME = (1 << 31) - 1
+
+
+
+def melody_intervals(melody):
+
+    ''' return transposition invariant pitch intervals of melody
+
+    Repeated notes (runs) are collapsed and silence dropped, so intervals are
+    independent of duration, tempo and key.
+
+    Args:
+        melody (np.array): note per frame, zero as silence
+
+    Returns:
+        (np.array): semitone interval between consecutive notes [int64]
+    '''
+
+    melody = np.asarray(melody).astype(np.int64)
+
+    # note onsets, change of note excl. silence
+    notes = melody[np.concatenate([[True], np.diff(melody) != 0])]
+    notes = notes[notes != 0]
+
+    return np.diff(notes)
+
+
+def shingles(intervals, n: int = 4):
+
+    ''' return set of interval n-gram values
+
+    Intervals are offset to bytes (1..255, clipped), n-gram packed as base 256
+    integer, n up to 7.
+
+    Args:
+        intervals (np.array): pitch intervals
+        n (int): n-gram length
+
+    Returns:
+        (np.array): unique n-gram values [uint64]
+    '''
+
+    if len(intervals) < n:
+        return np.zeros(0, dtype = np.uint64)
+
+    values = np.clip(np.asarray(intervals) + 128, 1, 255).astype(np.uint64)
+
+    # pack each window of n intervals, base 256; strided view of windows
+    # (as sliding_window_view, numpy 1.20+)
+    windows = np.lib.stride_tricks.as_strided(values,
+        (len(values) - n + 1, n), values.strides * 2, writeable = False)
+    grams = (windows << (np.uint64(8) * np.arange(n, dtype = np.uint64))).sum(axis = 1)
+
+    return np.unique(grams)
+
+
+def permutations(n_perm: int = 128, seed: int = 0):
+
+    ''' return random universal hash coefficients (a, b) per permutation '''
+
+    rng = np.random.default_rng(seed)
+
+    a = rng.integers(1, PRIME, n_perm, dtype = np.uint64)
+    b = rng.integers(0, PRIME, n_perm, dtype = np.uint64)
+
+    return a, b
+
+
+def minhash(values, a, b):
+
+    ''' return minhash signature of set of n-gram values
+
+    Each permutation h(x) = (a x + b) mod PRIME over values reduced mod PRIME;
+    empty sets give PRIME in all positions.
+
+    Args:
+        values (np.array): n-gram values [uint64]
+        a (np.array): hash multiplier per permutation
+        b (np.array): hash offset per permutation
+
+    Returns:
+        (np.array): minimum hash per permutation [uint64]
+    '''
+
+    if len(values) == 0:
+        return np.full(len(a), PRIME, dtype = np.uint64)
+
+    x = np.asarray(values, dtype = np.uint64) % np.uint64(PRIME)
+
+    return ((a[:, None] * x[None, :] + b[:, None]) % np.uint64(PRIME)).min(axis = 1)
+
+
+def lsh_candidates(signatures, bands: int = 32):
+
+    ''' return candidate near-duplicate pairs by banded locality sensitive hashing
+
+    Signatures are split into bands of rows; melodies sharing all rows of any
+    band are candidates. Cost is linear in melodies plus candidate pairs.
+
+    Args:
+        signatures (np.array): minhash signature per melody, shape (N, n_perm)
+        bands (int): number of bands, divides n_perm
+
+    Returns:
+        (set): candidate pairs (i, j), i < j
+    '''
+
+    rows = signatures.shape[1] // bands
+    pairs = set()
+
+    for band in range(bands):
+
+        # bucket melodies by band bytes
+        buckets = {}
+        chunk = np.ascontiguousarray(signatures[:, band * rows : (band + 1) * rows])
+
+        for i in range(len(chunk)):
+            buckets.setdefault(chunk[i].tobytes(), []).append(i)
+
+        # all pairs within bucket
+        for bucket in buckets.values():
+            for k, i in enumerate(bucket):
+                for j in bucket[k + 1:]:
+                    pairs.add((i, j))
+
+    return pairs
+
+
+def find_duplicates(melodies: list, n: int = 4, n_perm: int = 128, bands: int = 32,
+        threshold: float = 0.8, seed: int = 0):
+
+    ''' cluster near-duplicate melodies by minhash lsh over interval n-grams
+
+    Candidate pairs (lsh_candidates) are kept where estimated Jaccard similarity
+    (signature agreement) is at least threshold, clusters joined by union find.
+    Melodies with fewer than n intervals are never duplicates.
+
+    Args:
+        melodies (list): frame melodies
+        n (int): interval n-gram length
+        n_perm (int): minhash permutations
+        bands (int): lsh bands, divides n_perm
+        threshold (float): min estimated Jaccard similarity
+        seed (int): permutation seed
+
+    Returns:
+        (list): clusters of two or more melody indices, sorted
+    '''
+
+    (a, b) = permutations(n_perm, seed)
+
+    # signature per melody
+    sets = [ shingles(melody_intervals(melody), n) for melody in melodies ]
+    signatures = np.stack([ minhash(values, a, b) for values in sets ]) \
+        if sets else np.zeros((0, n_perm), dtype = np.uint64)
+
+    # union find over verified candidate pairs
+    parent = list(range(len(melodies)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # candidates among non-empty sets
+    valid = np.array([ i for i in range(len(sets)) if len(sets[i]) ], dtype = np.int64)
+
+    for (i, j) in lsh_candidates(signatures[valid], bands):
+
+        (i, j) = (int(valid[i]), int(valid[j]))
+
+        if (signatures[i] == signatures[j]).mean() >= threshold:
+            parent[find(j)] = find(i)
+
+    # group by root
+    clusters = {}
+    for i in range(len(melodies)):
+        clusters.setdefault(find(i), []).append(i)
+
+    return sorted( cluster for cluster in clusters.values() if len(cluster) > 1 )
+
+
+def dedup(dataset, out_path: str = None, **kwargs):
+
+    ''' write keep-list of dataset files, one per near-duplicate cluster
+
+    Longest melody (most notes) of each cluster is kept, first in file order
+    on ties; see find_duplicates for kwargs.
+
+    Args:
+        dataset (MelodyDataset): melody dataset
+        out_path (str): keep-list path, file name per line; not written if None
+
+    Returns:
+        (list): kept file names, dataset order
+        (list): clusters of file names
+    '''
+
+    melodies = [ dataset.decode(dataset[index]) for index in range(len(dataset)) ]
+
+    clusters = find_duplicates(melodies, **kwargs)
+
+    # drop all but longest of each cluster
+    drop = set()
+    for cluster in clusters:
+        keep = max(cluster, key = lambda i: (np.count_nonzero(melodies[i]), -i))
+        drop.update( i for i in cluster if i != keep )
+
+    names = [ name for i, name in enumerate(dataset.file_names) if i not in drop ]
+
+    if out_path is not None:
+        with open(out_path, 'w') as file:
+            file.write(''.join( name + '\n' for name in names ))
+
+    return names, [ [ dataset.file_names[i] for i in cluster ] for cluster in clusters ]
+
+
+
+if __name__ == '__main__':
+
+    # default to competition midi data, keep-list in data directory
+    dir_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), '..', 'data', 'comp-data', 'MIDI')
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(dir_path, 'keep.txt')
+
+    (names, clusters) = dedup(MelodyDataset(dir_path, lazy = True, backend = 'native'), out_path)
+
+    for cluster in clusters:
+        print('duplicates: {}'.format(', '.join(cluster)))
+
+    print('kept {} files, {} duplicate clusters'.format(len(names), len(clusters)))
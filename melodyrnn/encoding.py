@@ -0,0 +1,173 @@
+''' imports '''
+
+# array handling
+import numpy as np
+
+
+
+def rle_levels(n_buckets: int = 8):
+
+    ''' return number of run-length tokens, 7-bit note by duration bucket
+
+    Tokens are stored as int16, n_buckets up to 256.
+    '''
+
+    return 128 * n_buckets
+
+
+def rle_encode(melody, n_buckets: int = 8):
+
+    ''' encode frame melody as run-length (note, duration bucket) tokens
+
+    Runs of repeated note (zero as silence) are split into power of two
+    durations, largest first; duration bucket b spans 2**b frames, runs longer
+    than the largest bucket repeat it. Token is note * n_buckets + bucket.
+
+    Args:
+        melody (np.array): note per frame
+        n_buckets (int): number of duration buckets, max duration 2**(n_buckets-1)
+
+    Returns:
+        (np.array): tokens [int16]
+    '''
+
+    melody = np.asarray(melody).astype(np.int64)
+
+    if len(melody) == 0:
+        return np.zeros(0, dtype = np.int16)
+
+    # get run start index, note and length
+    start = np.concatenate([[0], np.where(np.diff(melody) != 0)[0] + 1])
+    notes = melody[start]
+    lengths = np.diff(np.concatenate([start, [len(melody)]]))
+
+    # split each run to repeats of largest bucket plus binary remainder
+    top = n_buckets - 1
+    (full, rest) = np.divmod(lengths, 2**top)
+
+    # remainder bits per run, largest bucket first
+    bits = (rest[:, None] >> np.arange(top - 1, -1, -1)[None, :]) & 1
+
+    # bucket count per run, largest first: full repeats of top bucket then bits
+    counts = np.concatenate([full[:, None], bits], axis = 1)
+    buckets = np.tile(np.arange(top, -1, -1), len(lengths))
+
+    # expand to one token per bucket occurrence, in run order
+    counts = counts.reshape(-1)
+    tokens = np.repeat(np.repeat(notes, n_buckets) * n_buckets + buckets, counts)
+
+    # return tokens, compact
+    return tokens.astype(np.int16)
+
+
+def rle_decode(tokens, n_buckets: int = 8):
+
+    ''' decode run-length tokens to frame melody, inverse of rle_encode
+
+    Args:
+        tokens (np.array): tokens
+        n_buckets (int): number of duration buckets
+
+    Returns:
+        (np.array): note per frame [uint8]
+    '''
+
+    tokens = np.asarray(tokens).astype(np.int64)
+
+    # get note, duration per token, expand to frames
+    (notes, buckets) = np.divmod(tokens, n_buckets)
+
+    return np.repeat(notes.astype(np.uint8), 2**buckets)
+
+
+
+class EventDecoder:
+
+    ''' incremental decoder of melody chunks to note events
+
+    Chunks of each sequence (frame melodies, or rle tokens if n_buckets > 1)
+    are decoded to runs of repeated note; a note event (note, start frame,
+    duration in frames) is emitted once its run ends, the last run of each
+    chunk held open to the next. Silence emits no events.
+    '''
+
+    def __init__(self, n_seqs: int, n_buckets: int = 1):
+
+        ''' init decoder
+
+        Args:
+            n_seqs (int): number of sequences (chunk rows)
+            n_buckets (int): rle duration buckets, one for frame melodies
+        '''
+
+        self.n_buckets = n_buckets
+
+        # frames decoded, open run (note, start) per sequence
+        self.position = [ 0 for _ in range(n_seqs) ]
+        self.pending = [ None for _ in range(n_seqs) ]
+
+
+    def update(self, chunk):
+
+        ''' decode next chunk, return completed events per sequence
+
+        Args:
+            chunk (np.array): samples, shape (n_seqs, chunk length)
+
+        Returns:
+            (list): list of (note, start, duration) per sequence
+        '''
+
+        return [ self.decode_row(row, samples) for row, samples in enumerate(chunk) ]
+
+
+    def decode_row(self, row: int, samples):
+
+        ''' decode chunk of one sequence, return completed events '''
+
+        melody = rle_decode(samples, self.n_buckets) if self.n_buckets > 1 \
+            else np.asarray(samples).astype(np.int64)
+
+        if len(melody) == 0:
+            return []
+
+        # get runs, absolute start frames
+        change = np.concatenate([[0], np.where(np.diff(melody) != 0)[0] + 1])
+        notes = melody[change].tolist()
+        starts = (change + self.position[row]).tolist()
+
+        events = []
+
+        # continue open run, else close it
+        if self.pending[row] is not None:
+
+            (note, start) = self.pending[row]
+
+            if note == notes[0]:
+                starts[0] = start
+            elif note != 0:
+                events.append( (note, start, starts[0] - start) )
+
+        # emit all runs but last, hold last open
+        for note, start, stop in zip(notes[:-1], starts[:-1], starts[1:]):
+            if note != 0:
+                events.append( (note, start, stop - start) )
+
+        self.pending[row] = (notes[-1], starts[-1])
+        self.position[row] += len(melody)
+
+        return events
+
+
+    def flush(self):
+
+        ''' close open runs, return their events per sequence '''
+
+        events = [ [ (note, start, position - start) ]
+            if pending is not None and note != 0 else []
+            for pending, position in zip(self.pending, self.position)
+            for (note, start) in [ pending or (0, 0) ] ]
+
+        self.pending = [ None for _ in self.pending ]
+
+        return events
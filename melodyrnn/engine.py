@@ -0,0 +1,159 @@
+''' imports '''
+
+# array handling, no torch import for fast startup
+import numpy as np
+
+
+
+def sigmoid(x):
+
+    ''' logistic function, dtype preserved '''
+
+    return 1 / (1 + np.exp(-x))
+
+
+def gru_cell(x, h, w_ih, w_hh, b_ih, b_hh):
+
+    ''' one GRU step (gates r, z, n as torch.nn.GRU) '''
+
+    gi = x @ w_ih.T + b_ih
+    gh = h @ w_hh.T + b_hh
+
+    (i_r, i_z, i_n) = np.split(gi, 3, axis = 1)
+    (h_r, h_z, h_n) = np.split(gh, 3, axis = 1)
+
+    r = sigmoid(i_r + h_r)
+    z = sigmoid(i_z + h_z)
+    n = np.tanh(i_n + r * h_n)
+
+    return (1 - z) * n + z * h
+
+
+def sample_inverse_cdf(probs, draws):
+
+    ''' sample index per row by inverse cdf of probabilities at uniform draws,
+    as Generator with draws '''
+
+    cdf = np.cumsum(probs, axis = 1, dtype = probs.dtype)
+
+    samples = (cdf < draws[:, None] * cdf[:, -1:]).sum(axis = 1)
+
+    return np.minimum(samples, probs.shape[1] - 1)
+
+
+
+class NumpyGenerator:
+
+    ''' numpy only SampleRNN sample generation from exported .npz
+
+    Reproduces Generator (fused set, tier schedule per step) from
+    weights exported by kernel.export_npz, in float32; samples drawn by
+    inverse cdf of uniform draws (as Generator with draws), so given the same
+    draws both generate the same samples.
+    '''
+
+    def __init__(self, path: str):
+
+        ''' load exported model
+
+        Args:
+            path (str): .npz exported by kernel.export_npz
+        '''
+
+        with np.load(path) as data:
+            params = { name: data[name] for name in data.files }
+
+        self.n_frame_samples = params['n_frame_samples'].tolist()
+        self.frame_sizes = params['frame_sizes'].tolist()
+        self.n_rnn = int(params['n_rnn'])
+        self.dim = int(params['dim'])
+        self.q_levels = int(params['q_levels'])
+        self.n_tiers = len(self.frame_sizes)
+        self.lookback = self.n_frame_samples[-1]
+
+        self.params = params
+
+
+    def __call__(self, n_seqs: int, seq_len: int, draws = None, seed: int = None):
+
+        ''' generate sequences
+
+        Args:
+            n_seqs (int): sequences generated in parallel
+            seq_len (int): samples per sequence
+            draws (np.array): uniform draws per sample, shape (n_seqs, seq_len);
+                drawn from seed if None
+            seed (int): random seed of draws
+
+        Returns:
+            (np.array): samples, shape (n_seqs, seq_len) [int64]
+        '''
+
+        p = self.params
+        (lookback, q_levels, dim) = (self.lookback, self.q_levels, self.dim)
+
+        if draws is None:
+            draws = np.random.default_rng(seed).random((n_seqs, seq_len), dtype = np.float32)
+
+        draws = np.asarray(draws, dtype = np.float32)
+
+        # preallocate sequences, dequantized tier inputs (as utils.linear_dequantize)
+        sequences = np.full((n_seqs, lookback + seq_len), q_levels // 2, dtype = np.int64)
+        inputs = 2 * (sequences.astype(np.float32) / np.float32(q_levels / 2) - 1)
+
+        # initial hidden state, upsampled frame per tier
+        hidden = [ np.repeat(p['h0_{}'.format(t)][:, None], n_seqs, axis = 1)
+            for t in range(self.n_tiers) ]
+        outputs = [ np.zeros((n_seqs, frame_size, dim), dtype = np.float32)
+            for frame_size in self.frame_sizes ]
+
+        bottom_frame_size = self.n_frame_samples[0]
+        offsets = q_levels * np.arange(bottom_frame_size)
+
+        for i in range(lookback, lookback + seq_len):
+
+            # run tiers at frame boundary, top tier first
+            for t in range(self.n_tiers - 1, -1, -1):
+
+                n_frame_samples = self.n_frame_samples[t]
+
+                if i % n_frame_samples != 0:
+                    continue
+
+                x = inputs[:, i - n_frame_samples : i] @ p['input_weight_{}'.format(t)].T \
+                    + p['input_bias_{}'.format(t)]
+
+                if t < self.n_tiers - 1:
+                    x = x + outputs[t + 1][:, (i // n_frame_samples) % self.frame_sizes[t + 1]]
+
+                # gru layers, one step
+                states = []
+                for layer in range(self.n_rnn):
+                    k = 4 * (t * self.n_rnn + layer)
+                    x = gru_cell(x, hidden[t][layer], p['gru_{}'.format(k)],
+                        p['gru_{}'.format(k + 1)], p['gru_{}'.format(k + 2)],
+                        p['gru_{}'.format(k + 3)])
+                    states.append(x)
+                hidden[t] = np.stack(states)
+
+                # upsample to frame, (batch, frame_size, dim)
+                outputs[t] = (x @ p['upsampling_weight_{}'.format(t)]).reshape(n_seqs, dim, -1) \
+                    .transpose(0, 2, 1) + p['upsampling_bias_{}'.format(t)]
+
+            # sample level mlp, table rows of window summed
+            index = sequences[:, i - bottom_frame_size : i] + offsets
+            x = p['mlp_table'][index].sum(axis = 1) + outputs[0][:, i % bottom_frame_size]
+            x = np.maximum(x, 0)
+            x = np.maximum(x @ p['mlp_hidden'].T + p['mlp_hidden_bias'], 0)
+            x = x @ p['mlp_output'].T + p['mlp_output_bias']
+
+            # log softmax, probabilities
+            x = x - x.max(axis = 1, keepdims = True)
+            probs = np.exp(x - np.log(np.exp(x).sum(axis = 1, keepdims = True)))
+
+            samples = sample_inverse_cdf(probs, draws[:, i - lookback])
+
+            sequences[:, i] = samples
+            inputs[:, i] = 2 * (samples.astype(np.float32) / np.float32(q_levels / 2) - 1)
+
+        return sequences[:, lookback :]
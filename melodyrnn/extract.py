@@ -0,0 +1,117 @@
+''' imports '''
+
+# array handling
+import numpy as np
+
+
+
+# melody extraction policies, active note kept per frame
+POLICIES = ['skyline', 'lowest', 'longest']
+
+
+
+def events2intervals(starts, notes, values, stop: int):
+
+    ''' convert note events to note on intervals
+
+    Each event sets state of its note from its start until the next event for
+    the same note (or stop); intervals of non-zero state are returned.
+
+    Args:
+        starts (np.array): start position per event, in event order
+        notes (np.array): note per event
+        values (np.array): note state per event (zero as off)
+        stop (int): end position of last state
+
+    Returns:
+        (np.array): note per interval
+        (np.array): interval start
+        (np.array): interval stop (exclusive)
+        (np.array): note state per interval
+    '''
+
+    starts = np.asarray(starts, dtype = np.int64)
+    notes = np.asarray(notes, dtype = np.int64)
+    values = np.asarray(values)
+
+    # order events by note, stable to keep event order within note
+    j = np.argsort(notes, kind = 'stable')
+
+    # interval stop at next event for same note, else stop
+    stops = np.full(len(j), stop, dtype = np.int64)
+    same = notes[j][1:] == notes[j][:-1]
+    stops[:-1][same] = starts[j][1:][same]
+
+    # keep non-empty note on intervals
+    k = (values[j] != 0) & (stops > starts[j])
+
+    return notes[j][k], starts[j][k], stops[k], values[j][k]
+
+
+def intervals2melody(notes, starts, stops, length: int, policy: str = 'skyline'):
+
+    ''' extract monophonic melody from note intervals
+
+    Intervals are written in ascending priority, so each frame keeps the
+    active note of highest priority: 'skyline' highest note, 'lowest' lowest
+    note, 'longest' longest interval (ties to highest note). All policies are
+    identical where intervals do not overlap.
+
+    Args:
+        notes (np.array): note per interval
+        starts (np.array): interval start frame
+        stops (np.array): interval stop frame (exclusive)
+        length (int): melody length, frames
+        policy (str): active note kept per frame, see POLICIES
+
+    Returns:
+        (np.array): note per frame, zero as silence [uint8]
+    '''
+
+    notes = np.asarray(notes, dtype = np.int64)
+
+    # get interval write order, ascending priority
+    if policy == 'skyline':
+        j = np.argsort(notes, kind = 'stable')
+    elif policy == 'lowest':
+        j = np.argsort(-notes, kind = 'stable')
+    elif policy == 'longest':
+        j = np.lexsort((notes, np.asarray(stops) - np.asarray(starts)))
+    else:
+        raise ValueError('unknown melody policy: {}'.format(policy))
+
+    melody = np.zeros(length, dtype = np.uint8)
+
+    # fill each interval, later (higher priority) overwrite
+    for n, a, b in zip(notes[j].tolist(), np.asarray(starts)[j].tolist(),
+            np.asarray(stops)[j].tolist()):
+        melody[a:b] = n
+
+    return melody
+
+
+def intervals2roll(notes, starts, stops, length: int):
+
+    ''' build 128-bit packed note roll from note intervals
+
+    Bit of note n is bit (7 - n % 8) of byte n // 8 per frame, as np.packbits
+    over 128 notes; intervals set bits directly, without dense roll.
+
+    Args:
+        notes (np.array): note per interval
+        starts (np.array): interval start frame
+        stops (np.array): interval stop frame (exclusive)
+        length (int): roll length, frames
+
+    Returns:
+        (np.array): packed note roll, shape (length, 16) [uint8]
+    '''
+
+    roll = np.zeros((length, 16), dtype = np.uint8)
+
+    # set note bit over each interval
+    for n, a, b in zip(np.asarray(notes).tolist(), np.asarray(starts).tolist(),
+            np.asarray(stops).tolist()):
+        roll[a:b, n >> 3] |= 0x80 >> (n & 7)
+
+    return roll
@@ -0,0 +1,113 @@
+import torch
+from torch.ao.quantization import quantize_dynamic
+
+import kernel
+from model import SampleRNN
+
+
+class PointwiseLinear(torch.nn.Module):
+
+    ''' 1x1 Conv1d as Linear over channels, (batch, channels, length) in and out '''
+
+    def __init__(self, conv):
+        super().__init__()
+
+        weight = kernel.effective_weight(conv).detach()
+        (out_channels, in_channels, _) = weight.size()
+
+        self.linear = torch.nn.Linear(in_channels, out_channels)
+        self.linear.weight.data.copy_(weight[:, :, 0])
+        self.linear.bias.data.copy_(conv.bias.detach())
+
+    def forward(self, input):
+        return self.linear(input.permute(0, 2, 1)).permute(0, 2, 1)
+
+
+class UpsamplingLinear(torch.nn.Module):
+
+    ''' LearnedUpsampling1d (transposed conv, stride = kernel size) as Linear
+    to kernel_size outputs per input step, plus bias per output position '''
+
+    def __init__(self, upsampling):
+        super().__init__()
+
+        weight = kernel.effective_weight(upsampling.conv_t).detach()
+        (in_channels, out_channels, kernel_size) = weight.size()
+
+        self.out_channels = out_channels
+        self.kernel_size = kernel_size
+
+        self.linear = torch.nn.Linear(in_channels, out_channels * kernel_size, bias=False)
+        self.linear.weight.data.copy_(weight.reshape(in_channels, -1).t())
+        self.bias = torch.nn.Parameter(upsampling.bias.detach().clone())
+
+    def forward(self, input):
+        (batch_size, _, length) = input.size()
+
+        output = self.linear(input.permute(0, 2, 1)).view(
+            batch_size, length, self.out_channels, self.kernel_size
+        ) + self.bias
+
+        return output.permute(0, 2, 1, 3).reshape(
+            batch_size, self.out_channels, length * self.kernel_size
+        )
+
+
+def model_config(model):
+
+    ''' return SampleRNN constructor arguments of model '''
+
+    rnn = model.frame_level_rnns[0]
+
+    return {
+        'frame_sizes': [ rnn.frame_size for rnn in model.frame_level_rnns ],
+        'n_rnn': rnn.rnn.num_layers,
+        'dim': model.dim,
+        'learn_h0': isinstance(rnn.h0, torch.nn.Parameter),
+        'q_levels': model.q_levels,
+        'weight_norm': hasattr(rnn.input_expand, 'weight_g'),
+    }
+
+
+def quantize_model(model):
+
+    ''' return dynamic int8 quantized copy of SampleRNN for cpu inference
+
+    Frame level input expand, sample level mlp hidden and output (1x1 convs)
+    and learned upsampling are expressed as Linear (weight norm folded in),
+    then GRU and Linear weights quantized to int8, activations quantized
+    dynamically per batch. Embedding and mlp input conv (weight norm removed)
+    kept fp32, folded into the Generator lookup table (fused).
+    '''
+
+    # copy by state dict, weight norm modules can't be deep copied
+    copied = SampleRNN(**model_config(model))
+    copied.load_state_dict(model.state_dict())
+    model = copied.cpu().eval()
+
+    for rnn in model.frame_level_rnns:
+        rnn.input_expand = PointwiseLinear(rnn.input_expand)
+        rnn.upsampling = UpsamplingLinear(rnn.upsampling)
+
+    mlp = model.sample_level_mlp
+    mlp.hidden = PointwiseLinear(mlp.hidden)
+    mlp.output = PointwiseLinear(mlp.output)
+
+    if hasattr(mlp.input, 'weight_g'):
+        torch.nn.utils.remove_weight_norm(mlp.input)
+
+    return quantize_dynamic(
+        model, {torch.nn.GRU, torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def load_quantized(path, frame_sizes, n_rnn, dim, learn_h0, q_levels,
+                   weight_norm):
+
+    ''' load SampleRNN checkpoint (state dict) from path, return quantized model
+    for use with Predictor and Generator (cuda=False) '''
+
+    model = SampleRNN(frame_sizes, n_rnn, dim, learn_h0, q_levels, weight_norm)
+    model.load_state_dict(torch.load(path, map_location='cpu'))
+
+    return quantize_model(model)
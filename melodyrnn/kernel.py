@@ -0,0 +1,237 @@
+import torch
+from torch.nn import functional as F
+
+import numpy as np
+
+from typing import List, Tuple
+
+
+def effective_weight(module):
+
+    ''' return weight of conv module, weight norm applied if set (dim 0) '''
+
+    if hasattr(module, 'weight_g'):
+        return torch._weight_norm(module.weight_v, module.weight_g, 0)
+
+    return module.weight
+
+
+class GenerationKernel(torch.nn.Module):
+
+    ''' single-step sample generation over all tiers, TorchScript compatible
+
+    Weights of a SampleRNN are captured once (weight norm applied), each tier
+    reduced to matrix products: input expand as linear, GRU layers as gru
+    cells, learned upsampling as one product per frame (looked up per step by
+    frame position), and the sample level mlp input as one gather-sum over its
+    embedding times input conv lookup table (SampleLevelMLP.lookup_table).
+    The tier schedule, mlp and multinomial sampling of n samples all run in
+    forward, so scripted, a whole generation call stays in compiled code.
+
+    Weights are a snapshot; rebuild the kernel after the model is trained.
+    '''
+
+    n_frame_samples: List[int]
+    frame_sizes: List[int]
+    input_weights: List[torch.Tensor]
+    input_biases: List[torch.Tensor]
+    gru_weights: List[torch.Tensor]
+    upsampling_weights: List[torch.Tensor]
+    upsampling_biases: List[torch.Tensor]
+
+    def __init__(self, model):
+        super().__init__()
+
+        rnns = model.frame_level_rnns
+
+        self.n_tiers = len(rnns)
+        self.n_rnn = rnns[0].rnn.num_layers
+        self.dim = model.dim
+        self.q_levels = model.q_levels
+
+        self.n_frame_samples = [ rnn.n_frame_samples for rnn in rnns ]
+        self.frame_sizes = [ rnn.frame_size for rnn in rnns ]
+
+        with torch.no_grad():
+
+            # input expand (dim, n_frame_samples, 1) as linear
+            self.input_weights = [ effective_weight(rnn.input_expand)[:, :, 0].contiguous()
+                for rnn in rnns ]
+            self.input_biases = [ rnn.input_expand.bias.detach() for rnn in rnns ]
+
+            # gru layer weights, (w_ih, w_hh, b_ih, b_hh) per layer per tier
+            self.gru_weights = [ getattr(rnn.rnn, '{}_l{}'.format(name, layer)).detach()
+                for rnn in rnns for layer in range(self.n_rnn)
+                for name in ['weight_ih', 'weight_hh', 'bias_ih', 'bias_hh'] ]
+
+            # upsampling conv transpose (dim, dim, frame_size) as (dim, dim * frame_size)
+            self.upsampling_weights = [ effective_weight(rnn.upsampling.conv_t)
+                .reshape(self.dim, -1).contiguous() for rnn in rnns ]
+            self.upsampling_biases = [ rnn.upsampling.bias.detach().t().contiguous()
+                for rnn in rnns ]
+
+            # mlp embedding times input conv, (frame_size * q_levels, dim) table
+            mlp = model.sample_level_mlp
+            self.mlp_table = mlp.lookup_table().view(-1, self.dim)
+            self.table_offsets = self.q_levels * torch.arange(self.frame_sizes[0],
+                device=self.mlp_table.device)
+            self.mlp_hidden = effective_weight(mlp.hidden)[:, :, 0].contiguous()
+            self.mlp_hidden_bias = mlp.hidden.bias.detach()
+            self.mlp_output = effective_weight(mlp.output)[:, :, 0].contiguous()
+            self.mlp_output_bias = mlp.output.bias.detach()
+
+    @torch.jit.export
+    def step(self, i: int, sequences: torch.Tensor, inputs: torch.Tensor,
+             hidden: List[torch.Tensor], outputs: List[torch.Tensor]
+             ) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+
+        ''' run tiers at frame boundary of step i, return sample distribution and
+        updated state (lists passed to compiled code are copies)
+
+        Args:
+            i (int): step, index into sequences
+            sequences (torch.Tensor): samples, shape (batch, length) [long]
+            inputs (torch.Tensor): dequantized samples, shape (batch, length)
+            hidden (list): gru hidden state per tier, (n_rnn, batch, dim)
+            outputs (list): upsampled frame per tier, (batch, frame_size, dim)
+
+        Returns:
+            (torch.Tensor): sample probabilities, shape (batch, q_levels)
+            (list): gru hidden state per tier
+            (list): upsampled frame per tier
+        '''
+
+        batch_size = sequences.size(0)
+
+        for tier_index in range(self.n_tiers - 1, -1, -1):
+
+            n_frame_samples = self.n_frame_samples[tier_index]
+
+            if i % n_frame_samples != 0:
+                continue
+
+            x = F.linear(inputs[:, i - n_frame_samples : i],
+                self.input_weights[tier_index], self.input_biases[tier_index])
+
+            if tier_index < self.n_tiers - 1:
+                frame_index = (i // n_frame_samples) % self.frame_sizes[tier_index + 1]
+                x = x + outputs[tier_index + 1][:, frame_index]
+
+            # gru layers, one step
+            states: List[torch.Tensor] = []
+            for layer in range(self.n_rnn):
+                k = 4 * (tier_index * self.n_rnn + layer)
+                x = torch.gru_cell(x, hidden[tier_index][layer], self.gru_weights[k],
+                    self.gru_weights[k + 1], self.gru_weights[k + 2], self.gru_weights[k + 3])
+                states.append(x)
+            hidden[tier_index] = torch.stack(states)
+
+            # upsample to frame, (batch, frame_size, dim)
+            outputs[tier_index] = torch.mm(x, self.upsampling_weights[tier_index]) \
+                .view(batch_size, self.dim, -1).transpose(1, 2) \
+                + self.upsampling_biases[tier_index]
+
+        bottom_frame_size = self.n_frame_samples[0]
+
+        # sample level mlp, table rows of window of previous samples summed
+        index = sequences[:, i - bottom_frame_size : i] + self.table_offsets
+        x = F.relu(F.embedding_bag(index, self.mlp_table, mode='sum')
+            + outputs[0][:, i % bottom_frame_size])
+        x = F.relu(F.linear(x, self.mlp_hidden, self.mlp_hidden_bias))
+        x = F.linear(x, self.mlp_output, self.mlp_output_bias)
+
+        return F.log_softmax(x, dim=1).exp(), hidden, outputs
+
+    def forward(self, sequences: torch.Tensor, inputs: torch.Tensor,
+                hidden: List[torch.Tensor], outputs: List[torch.Tensor],
+                start: int, n: int) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+
+        ''' generate n samples from step start, written to sequences and inputs
+
+        Returns:
+            (list): gru hidden state per tier
+            (list): upsampled frame per tier
+        '''
+
+        q_half = self.q_levels / 2
+
+        for i in range(start, start + n):
+
+            (sample_dist, hidden, outputs) = self.step(i, sequences, inputs, hidden, outputs)
+
+            samples = torch.multinomial(sample_dist, 1).squeeze(1)
+            sequences[:, i] = samples
+            inputs[:, i] = 2 * (samples.float() / q_half - 1)
+
+        return hidden, outputs
+
+
+def init_state(model, batch_size):
+
+    ''' return initial hidden state (h0) and zero upsampled frame per tier '''
+
+    rnns = model.frame_level_rnns
+
+    hidden = [ rnn.h0.detach().unsqueeze(1)
+        .expand(rnn.rnn.num_layers, batch_size, rnn.dim).contiguous() for rnn in rnns ]
+
+    outputs = [ torch.zeros(batch_size, rnn.frame_size, rnn.dim, device=rnn.h0.device)
+        for rnn in rnns ]
+
+    return hidden, outputs
+
+
+def compile_kernel(model, script=True):
+
+    ''' build generation kernel for model, TorchScript compiled if script set
+
+    Returns:
+        (GenerationKernel or torch.jit.ScriptModule): kernel
+    '''
+
+    kernel = GenerationKernel(model)
+
+    if script:
+        kernel = torch.jit.script(kernel)
+
+    return kernel
+
+
+def export_npz(model, path):
+
+    ''' export SampleRNN for numpy inference (engine.NumpyGenerator) to .npz
+
+    Weights as captured by GenerationKernel (weight norm folded in, mlp
+    embedding and input conv as lookup table), plus initial hidden state and
+    tier config.
+    '''
+
+    step_kernel = GenerationKernel(model)
+
+    arrays = {
+        'n_frame_samples': step_kernel.n_frame_samples,
+        'frame_sizes': step_kernel.frame_sizes,
+        'n_rnn': step_kernel.n_rnn,
+        'dim': step_kernel.dim,
+        'q_levels': step_kernel.q_levels,
+        'mlp_table': step_kernel.mlp_table,
+        'mlp_hidden': step_kernel.mlp_hidden,
+        'mlp_hidden_bias': step_kernel.mlp_hidden_bias,
+        'mlp_output': step_kernel.mlp_output,
+        'mlp_output_bias': step_kernel.mlp_output_bias,
+    }
+
+    for tier_index, rnn in enumerate(model.frame_level_rnns):
+        arrays['h0_{}'.format(tier_index)] = rnn.h0.detach()
+        arrays['input_weight_{}'.format(tier_index)] = step_kernel.input_weights[tier_index]
+        arrays['input_bias_{}'.format(tier_index)] = step_kernel.input_biases[tier_index]
+        arrays['upsampling_weight_{}'.format(tier_index)] = \
+            step_kernel.upsampling_weights[tier_index]
+        arrays['upsampling_bias_{}'.format(tier_index)] = \
+            step_kernel.upsampling_biases[tier_index]
+
+    for k, weight in enumerate(step_kernel.gru_weights):
+        arrays['gru_{}'.format(k)] = weight
+
+    np.savez(path, **{ name: value.cpu().numpy() if torch.is_tensor(value)
+        else np.asarray(value) for name, value in arrays.items() })
@@ -0,0 +1,137 @@
+''' imports '''
+
+# filesystem management
+import os
+
+# index serialisation
+import json
+
+# native midi decoder, event arrays
+import smf
+
+# grid quantization, tempo map to seconds
+import quantize
+
+# file content hashing, change check
+from cache import MelodyCache, file_changed
+
+
+
+def midi_metadata(path: str):
+
+    ''' get metadata of midi file
+
+    Note count and pitch range are over the melody track (first after meta
+    track, as midi2tracks), note on events with non-zero velocity.
+
+    Args:
+        path (str): midi file path
+
+    Returns:
+        (dict): key, time_signature, ticks_per_beat, n_tracks, n_notes,
+            pitch_min, pitch_max, duration (seconds)
+    '''
+
+    midi = smf.read_midi(path)
+
+    # melody track note on events
+    events = midi.tracks[0 if len(midi.tracks) == 1 else 1]
+    notes = events['note'][(events['type'] == smf.NOTE_ON) & (events['velocity'] > 0)]
+
+    # end tick over all tracks, duration by tempo map
+    end = max([ int(track['tick'][-1]) for track in midi.tracks if len(track) ] + [0])
+    duration = float(quantize.ticks2grid([end], midi, 1, 'second')[0])
+
+    return {
+        'key': midi.key_signature,
+        'time_signature': '{}/{}'.format(*midi.time_signature)
+            if midi.time_signature is not None else None,
+        'ticks_per_beat': midi.ticks_per_beat,
+        'n_tracks': len(midi.tracks),
+        'n_notes': int(len(notes)),
+        'pitch_min': int(notes.min()) if len(notes) else None,
+        'pitch_max': int(notes.max()) if len(notes) else None,
+        'duration': duration,
+    }
+
+
+
+class MidiIndex:
+
+    ''' persisted metadata index of midi corpus
+
+    Metadata per file (see midi_metadata) is stored in a json index with file
+    key (size, mtime, content hash); only new or changed files are read when
+    index is updated, so corpus subsets can be selected by metadata without
+    parsing midi files.
+    '''
+
+    def __init__(self, index_path: str = None):
+
+        ''' init index, load existing index if present; not persisted if no path '''
+
+        self.index_path = index_path
+        self.index = {}
+
+        if index_path is not None and os.path.exists(index_path):
+
+            with open(index_path, 'r') as file:
+                self.index = json.load(file)
+
+
+    def update(self, dir_path: str, file_names: list):
+
+        ''' read metadata for new or changed files, save index if changed
+
+        Returns:
+            (list): metadata per file
+        '''
+
+        changed = False
+
+        for name in file_names:
+
+            path = os.path.join(dir_path, name)
+            entry = self.index.get(name)
+
+            # unchanged file, mtime of touched file updated in entry
+            if entry is not None:
+
+                mtime = entry['mtime']
+
+                if not file_changed(entry, path):
+                    changed |= entry['mtime'] != mtime
+                    continue
+
+            # read metadata for file
+            stat = os.stat(path)
+            self.index[name] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'hash': MelodyCache.file_hash(path), **midi_metadata(path)}
+            changed = True
+
+        # save index
+        if changed and self.index_path is not None:
+
+            tmp = self.index_path + '.tmp'
+            with open(tmp, 'w') as file:
+                json.dump(self.index, file)
+            os.replace(tmp, self.index_path)
+
+        return [ self.index[name] for name in file_names ]
+
+
+    def filter(self, dir_path: str, file_names: list, filters: list):
+
+        ''' return file names for which all filter predicates hold
+
+        Args:
+            dir_path (str): directory of midi files
+            file_names (list): file names in directory
+            filters (list): predicates of metadata dict, e.g.
+                [ lambda meta: meta['n_tracks'] > 3, lambda meta: meta['key'] == 'C' ]
+        '''
+
+        metadata = self.update(dir_path, file_names)
+
+        return [ name for name, meta in zip(file_names, metadata)
+            if all( predicate(meta) for predicate in filters ) ]
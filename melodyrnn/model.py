@@ -1,5 +1,11 @@
 import nn
 import utils
+import kernel
+import encoding as enc
+import segment
+
+import time
+import warnings
 
 import torch
 from torch.nn import functional as F
@@ -114,12 +120,19 @@ class FrameLevelRNN(torch.nn.Module):
                             .expand(n_rnn, batch_size, self.dim) \
                             .contiguous()
 
+        # gru not cast by autocast, run in autocast precision explicitly
+        dtype = utils.autocast_dtype(input.device.type)
+        if dtype is not None:
+            (input, hidden) = (input.to(dtype), hidden.to(dtype))
+
         (output, hidden) = self.rnn(input, hidden)
 
         output = self.upsampling(
             output.permute(0, 2, 1)
         ).permute(0, 2, 1)
-        return (output, hidden)
+
+        # carried hidden state kept in parameter precision
+        return (output, hidden.to(self.h0.dtype))
 
 
 class SampleLevelMLP(torch.nn.Module):
@@ -164,9 +177,24 @@ class SampleLevelMLP(torch.nn.Module):
         if weight_norm:
             self.output = torch.nn.utils.weight_norm(self.output)
 
-    def forward(self, prev_samples, upper_tier_conditioning):
+    def lookup_table(self):
+
+        ''' return inference table of embedding times input conv per frame
+        position, shape (frame_size, q_levels, dim); weight norm applied '''
+
+        with torch.no_grad():
+            weight = kernel.effective_weight(self.input)
+            return torch.einsum('qe,dek->kqd', self.embedding.weight, weight) \
+                        .contiguous()
+
+    def forward(self, prev_samples, upper_tier_conditioning, table=None):
         (batch_size, _, _) = upper_tier_conditioning.size()
 
+        if table is not None:
+            return self.forward_table(
+                prev_samples, upper_tier_conditioning, table
+            )
+
         prev_samples = self.embedding(
             prev_samples.contiguous().view(-1)
         ).view(
@@ -180,7 +208,31 @@ class SampleLevelMLP(torch.nn.Module):
         x = F.relu(self.hidden(x))
         x = self.output(x).permute(0, 2, 1).contiguous()
 
-        return F.log_softmax(x.view(-1, self.q_levels)) \
+        # log softmax in fp32, also under autocast
+        return F.log_softmax(x.view(-1, self.q_levels).float(), dim=1) \
+                .view(batch_size, -1, self.q_levels)
+
+    def forward_table(self, prev_samples, upper_tier_conditioning, table):
+
+        ''' inference forward, embedding and input conv folded into table
+        gathers (see lookup_table), summed with conditioning in one add '''
+
+        (batch_size, length, dim) = upper_tier_conditioning.size()
+        (frame_size, q_levels, _) = table.size()
+
+        # row of table per window position, offset by frame position
+        index = prev_samples.unfold(1, frame_size, 1) + \
+            q_levels * torch.arange(frame_size, device=prev_samples.device)
+
+        x = F.embedding_bag(
+            index.reshape(-1, frame_size), table.view(-1, dim), mode='sum'
+        ).view(batch_size, length, dim) + upper_tier_conditioning
+
+        x = F.relu(x).permute(0, 2, 1)
+        x = F.relu(self.hidden(x))
+        x = self.output(x).permute(0, 2, 1).contiguous()
+
+        return F.log_softmax(x.view(-1, self.q_levels), dim=1) \
                 .view(batch_size, -1, self.q_levels)
 
 
@@ -204,16 +256,36 @@ class Runner:
 
 class Predictor(Runner, torch.nn.Module):
 
-    def __init__(self, model):
+    ''' training forward pass over all tiers, hidden state carried over calls
+    (truncated backprop through time) unless reset
+
+    With bf16 set, forward runs under bfloat16 autocast on the input device:
+    frame level rnns (incl. gru and learned upsampling) and sample level mlp
+    compute in bfloat16, parameters, gradients, carried hidden state and the
+    log softmax output stay fp32, so loss (sequence_nll_loss_bits) and
+    optimizer (incl. gradient_clipping) are unchanged; no loss scaling needed.
+    '''
+
+    def __init__(self, model, bf16=False):
         super().__init__(model)
+        self.bf16 = bf16
 
     def forward(self, input_sequences, reset):
 
+        with torch.autocast(input_sequences.device.type, dtype=torch.bfloat16,
+                            enabled=self.bf16):
+            return self.run_tiers(input_sequences, reset)
+
+    def run_tiers(self, input_sequences, reset):
+
         #print('predictor forward pass')
 
         if reset:
             self.reset_hidden_states()
 
+        # widen compact (uint8) input to long on device
+        input_sequences = input_sequences.long()
+
         (batch_size, _) = input_sequences.size()
 
         upper_tier_conditioning = None
@@ -253,50 +325,336 @@ class Predictor(Runner, torch.nn.Module):
 
 class Generator(Runner):
 
-    def __init__(self, model, cuda=True):
+    ''' batched sample generation without autograd
+
+    Output sequences and dequantized tier inputs are preallocated on device
+    once per call; tier inputs, conditioning and mlp inputs are views into
+    them. Tiers run only on steps at their frame boundary, by schedule over
+    one top tier frame. Throughput of last call stored in samples_per_sec.
+
+    With compiled set, all steps of a call run in a TorchScript compiled
+    generation kernel (kernel.GenerationKernel), compiled once and cached;
+    rebuilt when model weights changed (storage or in-place version of
+    parameters and buffers) or after refresh. Eager loop used if compilation
+    fails.
+
+    stream yields fixed size chunks as generated, hidden state carried over
+    chunks in a rolling buffer of lookback plus one chunk.
+
+    With fused set, the sample level mlp embedding and input conv are folded
+    into a lookup table (SampleLevelMLP.lookup_table) built per call.
+
+    generate_filtered runs many sequences in parallel, segments and filters
+    them incrementally (segment.SegmentFilter); rows which can no longer
+    yield an accepted segment are restarted as fresh sequences.
+    '''
+
+    def __init__(self, model, cuda=True, compiled=False, fused=False):
         super().__init__(model)
         self.cuda = cuda
+        self.compiled = compiled
+        self.fused = fused
+        self.samples_per_sec = None
+        self.segments_per_sec = None
+        self.refresh()
+
+    def refresh(self):
+
+        ''' drop cached compiled kernel, rebuilt from current weights on next call '''
+
+        self.compiled_kernel = None
+        self.kernel_version = None
+
+    def weights_version(self):
+
+        ''' return storage and in-place version of model parameters and buffers '''
+
+        return tuple( (tensor.data_ptr(), tensor._version)
+            for tensor in self.model.state_dict(keep_vars=True).values() )
+
+    def schedule(self):
+
+        ''' return tier indices run per step (top tier first), over lookback steps '''
+
+        rnns = self.model.frame_level_rnns
+
+        return [
+            [ tier_index for tier_index in reversed(range(len(rnns)))
+                if i % rnns[tier_index].n_frame_samples == 0 ]
+            for i in range(self.model.lookback)
+        ]
+
+    def __call__(self, n_seqs, seq_len, draws=None):
+
+        with utils.inference_mode():
+            sequences = self.generate(n_seqs, seq_len, draws)
+
+        # copy out of inference mode
+        return sequences.clone()
+
+    def generate(self, n_seqs, seq_len, draws=None):
+
+        start = time.perf_counter()
+
+        lookback = self.model.lookback
+
+        (sequences, inputs) = self.init_generation(n_seqs, lookback + seq_len)
+        self.run(sequences, inputs, lookback, seq_len, draws)
+
+        self.samples_per_sec = n_seqs * seq_len / (time.perf_counter() - start)
+
+        return sequences[:, lookback :].cpu()
+
+    def stream(self, n_seqs, chunk_len=None, n_chunks=None, events=False,
+               n_buckets=1):
+
+        ''' generate sequences chunk by chunk, yield each chunk when complete
+
+        Args:
+            n_seqs (int): sequences generated in parallel
+            chunk_len (int): samples per chunk, multiple of lookback (default 16
+                lookback), keeps tier frames aligned over chunks
+            n_chunks (int): number of chunks, unbounded if None
+            events (bool): also yield note events completed up to chunk, see
+                encoding.EventDecoder; open notes held to later chunks
+            n_buckets (int): rle duration buckets of samples, one for frame melodies
+
+        Yields:
+            (torch.Tensor): chunk samples, shape (n_seqs, chunk_len) [long]
+            (list): if events, note events (note, start, duration) per sequence
+        '''
+
+        lookback = self.model.lookback
+        chunk_len = 16 * lookback if chunk_len is None else chunk_len
+
+        if chunk_len % lookback != 0:
+            raise ValueError('chunk_len must be a multiple of lookback ({})'.format(lookback))
+
+        decoder = enc.EventDecoder(n_seqs, n_buckets) if events else None
+
+        with utils.inference_mode():
+            (sequences, inputs) = self.init_generation(n_seqs, lookback + chunk_len)
+
+        k = 0
+
+        while n_chunks is None or k < n_chunks:
+
+            start = time.perf_counter()
+
+            with utils.inference_mode():
+
+                self.run(sequences, inputs, lookback, chunk_len)
+
+                chunk = sequences[:, lookback :].cpu()
+
+                self.carry(sequences, inputs)
+
+            self.samples_per_sec = n_seqs * chunk_len / (time.perf_counter() - start)
+
+            # copy out of inference mode
+            chunk = chunk.clone()
+
+            k += 1
+
+            if decoder is None:
+                yield chunk
+                continue
+
+            chunk_events = decoder.update(chunk.numpy())
+
+            # close open notes after last chunk
+            if n_chunks is not None and k == n_chunks:
+                chunk_events = [ row + last for row, last in zip(chunk_events, decoder.flush()) ]
 
-    def __call__(self, n_seqs, seq_len):
-        # generation doesn't work with CUDNN for some reason
-        #torch.backends.cudnn.enabled = False
+            yield chunk, chunk_events
+
+    def generate_filtered(self, n_seqs, n_segments, chunk_len=None, seed_len=None,
+                          max_chunks=None, **kwargs):
+
+        ''' generate n_seqs sequences in parallel until n_segments accepted
+
+        Chunks of each row are segmented and filtered as generated; rows are
+        retired and their slot refilled with a fresh sequence (q_zero history,
+        initial hidden state) once seed_len samples are generated or no segment
+        can be accepted within the rest (SegmentFilter.viable). Accepted
+        segments per second of last call stored in segments_per_sec.
+
+        Args:
+            n_seqs (int): sequences generated in parallel
+            n_segments (int): accepted segments to return
+            chunk_len (int): samples per chunk, multiple of lookback (default 2
+                lookback); retired rows refilled at chunk end
+            seed_len (int): max samples per sequence (default 4 max_len)
+            max_chunks (int): max chunks generated, unbounded if None
+            kwargs: segment filter settings, see segment.SegmentFilter
+
+        Returns:
+            (list): accepted segments [uint8]
+        '''
+
+        start = time.perf_counter()
+
+        lookback = self.model.lookback
+        chunk_len = 2 * lookback if chunk_len is None else chunk_len
+
+        if chunk_len % lookback != 0:
+            raise ValueError('chunk_len must be a multiple of lookback ({})'.format(lookback))
+
+        filters = [ segment.SegmentFilter(**kwargs) for _ in range(n_seqs) ]
+        seed_len = 4 * filters[0].max_len if seed_len is None else seed_len
+
+        # samples generated per row since its seed
+        generated = np.zeros(n_seqs, dtype=np.int64)
+
+        segments = []
+        k = 0
+
+        with utils.inference_mode():
+
+            (sequences, inputs) = self.init_generation(n_seqs, lookback + chunk_len)
+
+            while len(segments) < n_segments and (max_chunks is None or k < max_chunks):
+
+                self.run(sequences, inputs, lookback, chunk_len)
+
+                chunk = sequences[:, lookback :].cpu().numpy()
+
+                self.carry(sequences, inputs)
+
+                generated += chunk_len
+                k += 1
+
+                # filter chunk per row, find retired rows
+                retired = []
+
+                for row in range(n_seqs):
+
+                    segments += filters[row].update(chunk[row])
+
+                    remaining = seed_len - generated[row]
+
+                    if remaining <= 0 or not filters[row].viable(remaining):
+                        retired.append(row)
+
+                # refill retired rows with fresh sequences
+                if retired:
+
+                    for row in retired:
+                        segments += filters[row].close()
+                        filters[row].reset()
+
+                    generated[retired] = 0
+                    self.reset_rows(retired, sequences, inputs)
+
+        self.segments_per_sec = len(segments) / (time.perf_counter() - start)
+
+        return segments[: n_segments]
+
+    def carry(self, sequences, inputs):
+
+        ''' carry last lookback samples to front of rolling buffer '''
+
+        lookback = self.model.lookback
+
+        sequences[:, : lookback] = sequences[:, -lookback :].clone()
+        inputs[:, : lookback] = inputs[:, -lookback :].clone()
+
+    def reset_rows(self, rows, sequences, inputs):
+
+        ''' restart rows as fresh sequences, at tier frame aligned step
+
+        History set to q_zero, hidden state to h0; upsampled tier outputs are
+        recomputed at the next (aligned) step.
+        '''
+
+        lookback = self.model.lookback
+        q_levels = self.model.q_levels
+        rows = torch.tensor(rows, dtype=torch.long, device=sequences.device)
+
+        sequences[rows, : lookback] = utils.q_zero(q_levels)
+        inputs[rows, : lookback] = 2 * utils.linear_dequantize(
+            sequences[rows, : lookback], q_levels
+        )
+
+        for tier_index, rnn in enumerate(self.model.frame_level_rnns):
+
+            h0 = rnn.h0.detach().unsqueeze(1)
+
+            if self.step_kernel is not None:
+                self.kernel_state[0][tier_index][:, rows] = h0
+
+            elif self.hidden_states[rnn] is not None:
+                self.hidden_states[rnn][:, rows] = h0
+
+    def init_generation(self, n_seqs, length):
+
+        ''' reset generation state, return preallocated sequences and inputs '''
+
+        q_levels = self.model.q_levels
+        device = torch.device('cuda' if self.cuda else 'cpu')
+
+        # preallocate sequences, dequantized tier inputs and sample buffer
+        sequences = torch.full((n_seqs, length),
+            utils.q_zero(q_levels), dtype=torch.long, device=device)
+        inputs = 2 * utils.linear_dequantize(sequences, q_levels)
+        self.samples = torch.empty(n_seqs, 1, dtype=torch.long, device=device)
+
+        # sample level mlp lookup table
+        self.table = self.model.sample_level_mlp.lookup_table() \
+            if self.fused else None
+
+        # compiled kernel (cached) and its state, else eager state
+        self.step_kernel = self.cached_kernel() if self.compiled else None
+
+        if self.step_kernel is not None:
+            self.kernel_state = kernel.init_state(self.model, n_seqs)
 
         self.reset_hidden_states()
+        self.frame_level_outputs = [None for _ in self.model.frame_level_rnns]
 
-        bottom_frame_size = self.model.frame_level_rnns[0].n_frame_samples
-        sequences = torch.LongTensor(n_seqs, self.model.lookback + seq_len) \
-                         .fill_(utils.q_zero(self.model.q_levels))
-        frame_level_outputs = [None for _ in self.model.frame_level_rnns]
-
-        for i in range(self.model.lookback, self.model.lookback + seq_len):
-            for (tier_index, rnn) in \
-                    reversed(list(enumerate(self.model.frame_level_rnns))):
-                if i % rnn.n_frame_samples != 0:
-                    continue
-
-                prev_samples = torch.autograd.Variable(
-                    2 * utils.linear_dequantize(
-                        sequences[:, i - rnn.n_frame_samples : i],
-                        self.model.q_levels
-                    ).unsqueeze(1),
-                    volatile=True
-                )
+        return sequences, inputs
+
+    def run(self, sequences, inputs, start, n, draws=None):
+
+        ''' generate n samples from step start, written to sequences and inputs;
+        step is aligned to tier frames, generation state carried over calls
 
-                #print(sequences)
+        With draws (uniform per sample, shape (batch, n)) set, samples are
+        drawn by inverse cdf instead of multinomial, in the eager loop, as
+        engine.NumpyGenerator with the same draws.
+        '''
 
-                #prev_samples = torch.autograd.Variable(
-                #    (sequences[:, i - rnn.n_frame_samples : i]).float().unsqueeze(1),
-                #    volatile=True
-                #)
+        # generate all steps in compiled kernel
+        if self.step_kernel is not None and draws is None:
+            self.kernel_state = self.step_kernel(
+                sequences, inputs, *self.kernel_state, start, n
+            )
+            return
+
+        rnns = self.model.frame_level_rnns
+        lookback = self.model.lookback
+        q_levels = self.model.q_levels
+
+        bottom_frame_size = rnns[0].n_frame_samples
+
+        frame_level_outputs = self.frame_level_outputs
+        samples = self.samples
+        schedule = self.schedule()
+
+        for i in range(start, start + n):
 
-                if self.cuda:
-                    prev_samples = prev_samples.cuda()
+            # run tiers at frame boundary only
+            for tier_index in schedule[i % lookback]:
 
-                if tier_index == len(self.model.frame_level_rnns) - 1:
+                rnn = rnns[tier_index]
+
+                prev_samples = inputs[:, i - rnn.n_frame_samples : i].unsqueeze(1)
+
+                if tier_index == len(rnns) - 1:
                     upper_tier_conditioning = None
                 else:
                     frame_index = (i // rnn.n_frame_samples) % \
-                        self.model.frame_level_rnns[tier_index + 1].frame_size
+                        rnns[tier_index + 1].frame_size
                     upper_tier_conditioning = \
                         frame_level_outputs[tier_index + 1][:, frame_index, :] \
                                            .unsqueeze(1)
@@ -305,20 +663,44 @@ class Generator(Runner):
                     rnn, prev_samples, upper_tier_conditioning
                 )
 
-            prev_samples = torch.autograd.Variable(
-                sequences[:, i - bottom_frame_size : i],
-                volatile=True
-            )
-            if self.cuda:
-                prev_samples = prev_samples.cuda()
             upper_tier_conditioning = \
-                frame_level_outputs[0][:, i % bottom_frame_size, :] \
-                                      .unsqueeze(1)
+                frame_level_outputs[0][:, i % bottom_frame_size, :].unsqueeze(1)
+
             sample_dist = self.model.sample_level_mlp(
-                prev_samples, upper_tier_conditioning
-            ).squeeze(1).exp_().data
-            sequences[:, i] = sample_dist.multinomial(1).squeeze(1)
+                sequences[:, i - bottom_frame_size : i], upper_tier_conditioning,
+                self.table
+            ).squeeze(1).exp_()
+
+            # sample into buffer, store sample and its dequantized tier input
+            if draws is None:
+                torch.multinomial(sample_dist, 1, out=samples)
+            else:
+                cdf = sample_dist.cumsum(dim=1)
+                u = draws[:, i - start].to(cdf.device).unsqueeze(1)
+                torch.sum(cdf < u * cdf[:, -1:], dim=1, keepdim=True, out=samples)
+                samples.clamp_(max=q_levels - 1)
+            sequences[:, i] = samples[:, 0]
+            inputs[:, i].copy_(samples[:, 0]).div_(q_levels / 2).sub_(1).mul_(2)
+
+    def cached_kernel(self):
+
+        ''' return cached compiled kernel, compiled if none or weights changed '''
+
+        version = self.weights_version()
+
+        if version != self.kernel_version:
+            self.compiled_kernel = self.compile()
+            self.kernel_version = version
+
+        return self.compiled_kernel
+
+    def compile(self):
+
+        ''' return compiled generation kernel of model, None (eager) on failure '''
 
-        #torch.backends.cudnn.enabled = True
+        try:
+            return kernel.compile_kernel(self.model)
 
-        return sequences[:, self.model.lookback :]
+        except Exception as e:
+            warnings.warn('generation kernel compile failed, eager fallback: {!r}'.format(e))
+            return None
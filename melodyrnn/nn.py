@@ -40,7 +40,9 @@ class LearnedUpsampling1d(nn.Module):
             batch_size, self.conv_t.out_channels,
             length * kernel_size
         )
-        return self.conv_t(input) + bias
+        output = self.conv_t(input)
+        # bias in output precision (lower under autocast)
+        return output + bias.to(output.dtype)
 
 
 def lecun_uniform(tensor):
@@ -66,5 +68,5 @@ def concat_init(tensor, inits):
 def sequence_nll_loss_bits(input, target, *args, **kwargs):
     (_, _, n_classes) = input.size()
     return nn.functional.nll_loss(
-        input.view(-1, n_classes), target.view(-1), *args, **kwargs
+        input.view(-1, n_classes), target.reshape(-1).long(), *args, **kwargs
     ) * math.log(math.e, 2)
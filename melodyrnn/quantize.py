@@ -0,0 +1,201 @@
+''' imports '''
+
+# array handling
+import numpy as np
+
+# native midi decoder, event arrays
+import smf
+
+# melody extraction from note intervals
+import extract
+
+
+
+# default tempo, microseconds per beat (120 bpm)
+DEFAULT_TEMPO = 500000
+
+
+
+def midi2notes(midi, track: int):
+
+    ''' extract note events with absolute ticks from track of midi
+
+    Absolute ticks include delta time of all messages in track; note on sets
+    note state one (incl. zero velocity), note off zero, as midi2tracks.
+
+    Args:
+        midi (mido.MidiFile or smf.MidiEvents): midi file
+        track (int): track index
+
+    Returns:
+        (np.array): absolute tick per note event
+        (np.array): note per note event
+        (np.array): note state per note event (0, 1)
+        (int): track end absolute tick
+    '''
+
+    # native decoded events, absolute ticks stored
+    if isinstance(midi, smf.MidiEvents):
+
+        events = midi.tracks[track]
+
+        j = (events['type'] == smf.NOTE_ON) | (events['type'] == smf.NOTE_OFF)
+
+        end = int(events['tick'][-1]) if len(events) else 0
+
+        return (events['tick'][j], events['note'][j].astype(np.int64),
+            (events['type'][j] == smf.NOTE_ON).astype(np.int64), end)
+
+    # mido messages, accumulate delta time over all messages
+    ticks, notes, values = [], [], []
+    tick = 0
+
+    for msg in midi.tracks[track]:
+
+        tick += msg.time
+
+        if msg.type in ['note_on', 'note_off']:
+            ticks.append(tick)
+            notes.append(msg.note)
+            values.append(0 if msg.type == 'note_off' else 1)
+
+    return (np.array(ticks, dtype = np.int64), np.array(notes, dtype = np.int64),
+        np.array(values, dtype = np.int64), tick)
+
+
+def tempo_map(midi):
+
+    ''' get tempo changes over all tracks of midi
+
+    Returns:
+        (np.array): absolute tick per tempo change, first at tick zero
+        (np.array): tempo per change, microseconds per beat
+    '''
+
+    # native decoded events, merged tempo map stored
+    if isinstance(midi, smf.MidiEvents):
+        ticks = midi.tempo['tick']
+        tempos = midi.tempo['tempo']
+
+    # mido messages, accumulate delta time per track
+    else:
+        changes = []
+
+        for track in midi.tracks:
+
+            tick = 0
+
+            for msg in track:
+
+                tick += msg.time
+
+                if msg.type == 'set_tempo':
+                    changes.append( (tick, msg.tempo) )
+
+        changes = sorted(changes, key = lambda change: change[0])
+
+        ticks = np.array([ change[0] for change in changes ], dtype = np.int64)
+        tempos = np.array([ change[1] for change in changes ], dtype = np.int64)
+
+    # ensure tempo defined from tick zero
+    if len(ticks) == 0 or ticks[0] != 0:
+        ticks = np.concatenate([[0], ticks]).astype(np.int64)
+        tempos = np.concatenate([[DEFAULT_TEMPO], tempos]).astype(np.int64)
+
+    return ticks, tempos
+
+
+def ticks2grid(ticks, midi, grid: int, unit: str = 'beat'):
+
+    ''' convert absolute ticks to grid positions
+
+    Args:
+        ticks (np.array): absolute ticks
+        midi (mido.MidiFile or smf.MidiEvents): midi file, ticks per beat and tempo
+        grid (int): grid steps per unit
+        unit (str): grid unit, 'beat' (ticks per beat) or 'second' (tempo map)
+
+    Returns:
+        (np.array): grid position per tick [float]
+    '''
+
+    ticks = np.asarray(ticks, dtype = np.float64)
+
+    # beat relative grid, independent of tempo
+    if unit == 'beat':
+        return ticks * grid / midi.ticks_per_beat
+
+    if unit != 'second':
+        raise ValueError('unknown grid unit: {}'.format(unit))
+
+    # get tempo changes, seconds per tick within each tempo segment
+    (change_ticks, tempos) = tempo_map(midi)
+    rate = tempos / (midi.ticks_per_beat * 1e6)
+
+    # get seconds at each tempo change
+    seconds = np.concatenate([[0.], np.cumsum(np.diff(change_ticks) * rate[:-1])])
+
+    # get tempo segment per tick, seconds from segment start
+    k = np.searchsorted(change_ticks, ticks, side = 'right') - 1
+
+    return (seconds[k] + (ticks - change_ticks[k]) * rate[k]) * grid
+
+
+def quantize_intervals(midi, track: int, grid: int, unit: str = 'beat'):
+
+    ''' quantize note events of track of midi to note intervals over grid
+
+    Note events are converted to note intervals (state held until the next event
+    for the same note), mapped to first grid point at or after each position.
+
+    Args:
+        midi (mido.MidiFile or smf.MidiEvents): midi file
+        track (int): track index
+        grid (int): grid steps per unit
+        unit (str): grid unit, 'beat' or 'second'
+
+    Returns:
+        (tuple): note, start, stop, value per interval (see extract.events2intervals)
+        (int): grid points up to track end
+    '''
+
+    # get note events, track end
+    (ticks, notes, values, end) = midi2notes(midi, track)
+    end = max(end, int(ticks[-1]) if len(ticks) else 0)
+
+    # get grid positions of events and track end
+    positions = ticks2grid(np.concatenate([ticks, [end]]), midi, grid, unit)
+
+    # first grid point at or after each event, track end
+    points = np.ceil(positions).astype(np.int64)
+
+    # return note intervals over grid points, grid points up to track end
+    return (extract.events2intervals(points[:-1], notes, values, points[-1]),
+        int(np.floor(positions[-1])) + 1)
+
+
+def quantize_melody(midi, grid: int, unit: str = 'beat', policy: str = 'skyline'):
+
+    ''' quantize melody track of midi directly onto grid
+
+    Each grid point takes the active note by policy (default highest) at its
+    position, without tick level roll.
+
+    Args:
+        midi (mido.MidiFile or smf.MidiEvents): midi file
+        grid (int): grid steps per unit
+        unit (str): grid unit, 'beat' or 'second'
+        policy (str): active note kept per frame, see extract.POLICIES
+
+    Returns:
+        (np.array): melody, note per grid step, zero as silence [uint8]
+    '''
+
+    # melody track, first after meta track (as midi2tracks)
+    track = 0 if len(midi.tracks) == 1 else 1
+
+    # get note intervals over grid
+    ((notes, starts, stops, _), length) = quantize_intervals(midi, track, grid, unit)
+
+    # return melody over grid points up to track end
+    return extract.intervals2melody(notes, starts, stops, length, policy)
@@ -0,0 +1,171 @@
+''' imports '''
+
+# array handling
+import numpy as np
+
+
+
+class SegmentFilter:
+
+    ''' incremental melody segmentation and filter of one generated sequence
+
+    Samples are split into segments at note jumps (absolute step between
+    consecutive samples, incl. to or from silence) above jump, or at max_len;
+    closed segments with leading and trailing silence stripped are accepted
+    if longer than min_len, with more than 3 distinct values, pitch range
+    (excl. silence) below max_range and note changes per frame at least
+    min_density (as the melody segment filter notebook).
+
+    A segment is dropped as soon as its pitch range reaches max_range; viable
+    reports whether an accepted segment is still possible within the
+    remaining samples of the sequence.
+    '''
+
+    def __init__(self, jump: int = 12, min_len: int = 500, max_len: int = 800,
+            max_range: int = 20, min_density: float = 0.007):
+
+        ''' init filter
+
+        Args:
+            jump (int): max note step within segment
+            min_len (int): min segment length, frames (exclusive)
+            max_len (int): max segment length, longer segments split
+            max_range (int): max pitch range of segment (exclusive)
+            min_density (float): min note changes per frame
+        '''
+
+        self.jump = jump
+        self.min_len = min_len
+        self.max_len = max_len
+        self.max_range = max_range
+        self.min_density = min_density
+
+        self.reset()
+
+
+    def reset(self):
+
+        ''' reset to start of new sequence '''
+
+        # current segment parts, length, pitch bounds (excl. silence), dropped flag
+        self.parts = []
+        self.length = 0
+        self.low = 128
+        self.high = -1
+        self.dead = False
+
+        # last sample, none at sequence start
+        self.last = None
+
+
+    def update(self, samples):
+
+        ''' add samples, return segments accepted on close
+
+        Args:
+            samples (np.array): next samples of sequence
+
+        Returns:
+            (list): accepted segments [uint8]
+        '''
+
+        samples = np.asarray(samples).astype(np.int64)
+        accepted = []
+
+        # split points at note jumps, incl. jump from last sample of previous update
+        steps = np.abs(np.diff(np.concatenate([[samples[0]
+            if self.last is None else self.last], samples])))
+        splits = set(np.where(steps > self.jump)[0].tolist())
+
+        bounds = sorted(splits | {0, len(samples)})
+
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+
+            # close segment at jump
+            if start in splits:
+                accepted += self.close()
+
+            # add part, close at max length
+            part = samples[start:stop]
+
+            while len(part):
+                take = self.max_len - self.length
+                self.add(part[:take])
+                part = part[take:]
+
+                if self.length >= self.max_len:
+                    accepted += self.close()
+
+        if len(samples):
+            self.last = int(samples[-1])
+
+        return accepted
+
+
+    def add(self, part):
+
+        ''' add part to current segment, drop segment on pitch range '''
+
+        self.length += len(part)
+
+        if self.dead:
+            return
+
+        notes = part[part != 0]
+        if len(notes):
+            self.low = min(self.low, int(notes.min()))
+            self.high = max(self.high, int(notes.max()))
+
+        if self.high - self.low >= self.max_range:
+            self.dead = True
+            self.parts = []
+            return
+
+        self.parts.append(part)
+
+
+    def close(self):
+
+        ''' close current segment, return [segment] if accepted, else [] '''
+
+        (parts, dead) = (self.parts, self.dead)
+
+        self.parts = []
+        self.length = 0
+        self.low = 128
+        self.high = -1
+        self.dead = False
+
+        if dead or not parts:
+            return []
+
+        seg = np.concatenate(parts)
+
+        # distinct values incl. silence, before strip
+        if len(np.unique(seg)) <= 3:
+            return []
+
+        # strip leading, trailing silence
+        z = np.where(seg != 0)[0]
+        seg = seg[z[0] : z[-1] + 1]
+
+        if len(seg) <= self.min_len:
+            return []
+
+        # note changes per frame
+        if np.count_nonzero(np.diff(seg)) < self.min_density * len(seg):
+            return []
+
+        return [ seg.astype(np.uint8) ]
+
+
+    def viable(self, remaining: int):
+
+        ''' return whether a segment can still be accepted within remaining samples '''
+
+        # current segment can reach min length
+        if not self.dead and self.length + remaining > self.min_len:
+            return True
+
+        # new segment after next jump
+        return remaining > self.min_len
@@ -0,0 +1,261 @@
+''' imports '''
+
+# array handling
+import numpy as np
+
+
+
+# event array dtype; tick absolute, time delta (as mido message time)
+EVENT_DTYPE = np.dtype([
+    ('tick', np.int64),
+    ('time', np.int64),
+    ('type', np.uint8),
+    ('channel', np.uint8),
+    ('note', np.uint8),
+    ('velocity', np.uint8),
+])
+
+# tempo map dtype; tick absolute, tempo in microseconds per beat
+TEMPO_DTYPE = np.dtype([
+    ('tick', np.int64),
+    ('tempo', np.int64),
+])
+
+# event type codes; channel messages by status high nibble, else status byte
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+SYSEX = 0xF0
+META = 0xFF
+
+# meta event type codes for tempo change, time and key signature
+META_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+META_KEY_SIGNATURE = 0x59
+
+# key name by (sharps / flats, minor), as mido
+KEY_NAMES = dict(
+    [ ((sf, 0), name) for sf, name in zip(range(-7, 8), ['Cb', 'Gb', 'Db', 'Ab', 'Eb',
+        'Bb', 'F', 'C', 'G', 'D', 'A', 'E', 'B', 'F#', 'C#']) ] +
+    [ ((sf, 1), name) for sf, name in zip(range(-7, 8), ['Abm', 'Ebm', 'Bbm', 'Fm', 'Cm',
+        'Gm', 'Dm', 'Am', 'Em', 'Bm', 'F#m', 'C#m', 'G#m', 'D#m', 'A#m']) ])
+
+# data bytes following status byte, by channel message type
+CHANNEL_LENGTH = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+# data bytes following status byte, by system common / real time status
+SYSTEM_LENGTH = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0,
+    0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+
+
+class MidiEvents:
+
+    ''' decoded standard midi file, event array per track '''
+
+    def __init__(self, ticks_per_beat: int, tracks: list, tempo,
+            key_signature: str = None, time_signature: tuple = None):
+
+        # store ticks per beat, track event arrays, merged tempo map
+        self.ticks_per_beat = ticks_per_beat
+        self.tracks = tracks
+        self.tempo = tempo
+
+        # store first key signature (name), time signature (numerator, denominator)
+        self.key_signature = key_signature
+        self.time_signature = time_signature
+
+
+
+def read_varlen(data: bytes, i: int):
+
+    ''' read variable length quantity at offset, return (value, next offset) '''
+
+    value = 0
+
+    while True:
+
+        byte = data[i]
+        i += 1
+
+        value = (value << 7) | (byte & 0x7F)
+
+        if byte < 0x80:
+            return value, i
+
+
+def decode_track(data: bytes):
+
+    ''' decode track chunk data to event array
+
+    Every event (channel, system, sysex, meta) is emitted in order, matching
+    mido track messages; running status is applied to channel messages, and
+    is not set by meta events. Sysex and meta payloads are skipped, except tempo,
+    time and key signature.
+
+    Args:
+        data (bytes): track chunk data (excl. chunk header)
+
+    Returns:
+        (np.array): track events [EVENT_DTYPE]
+        (list): kept meta events, list of (tick, meta type, payload)
+    '''
+
+    # initialise event field lists, kept meta events
+    ticks, times, types, channels, notes, velocities = [], [], [], [], [], []
+    meta = []
+
+    # init offset, absolute tick, running status
+    i = 0
+    tick = 0
+    last_status = None
+
+    while i < len(data):
+
+        # get delta time, update absolute tick
+        (delta, i) = read_varlen(data, i)
+        tick += delta
+
+        status = data[i]
+        i += 1
+
+        # running status, first data byte already read
+        if status < 0x80:
+            if last_status is None:
+                raise OSError('running status without last_status')
+            status = last_status
+            i -= 1
+
+        # meta messages don't set running status
+        elif status != META:
+            last_status = status
+
+        note = velocity = channel = 0
+
+        # meta event, skip payload except tempo, time and key signature
+        if status == META:
+
+            note = data[i]
+            (length, i) = read_varlen(data, i + 1)
+
+            if note in (META_TEMPO, META_TIME_SIGNATURE, META_KEY_SIGNATURE):
+                meta.append( (tick, note, data[i : i + length]) )
+
+            i += length
+            kind = META
+
+        # sysex event, skip payload
+        elif status == 0xF0 or status == 0xF7:
+
+            (length, i) = read_varlen(data, i)
+            i += length
+            kind = SYSEX
+
+        # channel message, type by high nibble
+        elif status < 0xF0:
+
+            kind = status & 0xF0
+            channel = status & 0x0F
+
+            note = data[i]
+            if CHANNEL_LENGTH[kind] == 2:
+                velocity = data[i + 1]
+            i += CHANNEL_LENGTH[kind]
+
+        # system common / real time message
+        else:
+
+            if status not in SYSTEM_LENGTH:
+                raise OSError('undefined status byte 0x{:02x}'.format(status))
+
+            kind = status
+            if SYSTEM_LENGTH[kind] > 0:
+                note = data[i]
+            if SYSTEM_LENGTH[kind] > 1:
+                velocity = data[i + 1]
+            i += SYSTEM_LENGTH[kind]
+
+        # store event
+        ticks.append(tick)
+        times.append(delta)
+        types.append(kind)
+        channels.append(channel)
+        notes.append(note)
+        velocities.append(velocity)
+
+    # build event array from field lists
+    events = np.empty(len(ticks), dtype = EVENT_DTYPE)
+    events['tick'] = ticks
+    events['time'] = times
+    events['type'] = types
+    events['channel'] = channels
+    events['note'] = notes
+    events['velocity'] = velocities
+
+    # return track events, kept meta events
+    return events, meta
+
+
+def read_midi(path: str):
+
+    ''' read standard midi file to event arrays
+
+    Args:
+        path (str): midi file path
+
+    Returns:
+        (MidiEvents): ticks per beat, event array per track, tempo map
+    '''
+
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    # check header chunk
+    if data[:4] != b'MThd':
+        raise OSError('MThd not found. Probably not a MIDI file')
+
+    # get header chunk size, number of tracks, time division
+    size = int.from_bytes(data[4:8], 'big')
+    n_tracks = int.from_bytes(data[10:12], 'big')
+    ticks_per_beat = int.from_bytes(data[12:14], 'big')
+
+    # initialise track list, kept meta events
+    tracks = []
+    meta = []
+
+    # iterate chunks after header
+    i = 8 + size
+
+    while len(tracks) < n_tracks:
+
+        if i + 8 > len(data):
+            raise EOFError
+
+        # get chunk name, size
+        name = data[i : i + 4]
+        size = int.from_bytes(data[i + 4 : i + 8], 'big')
+        i += 8
+
+        # decode track chunks, skip unknown chunks
+        if name == b'MTrk':
+            (events, track_meta) = decode_track(data[i : i + size])
+            tracks.append(events)
+            meta.extend(track_meta)
+
+        i += size
+
+    # merge meta events over tracks, stable by tick
+    meta = sorted(meta, key = lambda event: event[0])
+
+    # get tempo map
+    tempo = np.array([ (tick, int.from_bytes(payload, 'big'))
+        for (tick, kind, payload) in meta if kind == META_TEMPO ], dtype = TEMPO_DTYPE)
+
+    # get first key signature, time signature
+    key_signature = next(( KEY_NAMES.get(( payload[0] - 256 * (payload[0] > 127),
+        payload[1] )) for (_, kind, payload) in meta if kind == META_KEY_SIGNATURE ), None)
+
+    time_signature = next(( (payload[0], 2**payload[1])
+        for (_, kind, payload) in meta if kind == META_TIME_SIGNATURE ), None)
+
+    # return decoded midi
+    return MidiEvents(ticks_per_beat, tracks, tempo, key_signature, time_signature)
@@ -0,0 +1,244 @@
+''' imports '''
+
+# filesystem management
+import os
+import sys
+import argparse
+
+# timing
+import time
+
+# array handling
+import numpy as np
+
+# tensors, multi-process data parallel
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+# midi dataset, sample-rnn model and training
+from dataset import MelodyDataset, MelodyDataLoader
+from model import SampleRNN, Predictor
+from optim import gradient_clipping
+from nn import sequence_nll_loss_bits
+
+
+
+def shard(dataset, rank: int, world_size: int):
+
+    ''' return strided shard of dataset for rank, melodies rank, rank + world_size, ... '''
+
+    return torch.utils.data.Subset(dataset, range(rank, len(dataset), world_size))
+
+
+def all_reduce_gradients(parameters: list, world_size: int):
+
+    ''' average gradients over ranks, one all-reduce over flattened gradients;
+    parameters without gradient (h0 on carried hidden state) skipped, same on
+    all ranks as chunk resets are in lockstep '''
+
+    grads = [ p.grad for p in parameters if p.grad is not None ]
+
+    flat = torch.cat([ grad.reshape(-1) for grad in grads ])
+    dist.all_reduce(flat)
+    flat /= world_size
+
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset : offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
+
+
+def train_worker(rank: int, world_size: int, port: int, config: dict, results):
+
+    ''' train one rank: shard of dataset, own Predictor (TBPTT hidden state
+    carried over its chunks), gradients averaged over ranks before each
+    optimizer step (gradient_clipping); rank 0 logs and reports throughput
+
+    Args:
+        rank (int): process rank
+        world_size (int): number of processes
+        port (int): rendezvous port on localhost
+        config (dict): training config, see train
+        results (SimpleQueue): rank 0 puts (samples per second, last loss)
+    '''
+
+    dist.init_process_group('gloo', init_method = 'tcp://127.0.0.1:{}'.format(port),
+        rank = rank, world_size = world_size)
+
+    # share cores between ranks
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    # same init on all ranks, broadcast from rank 0 to be sure
+    torch.manual_seed(config['seed'])
+    np.random.seed(config['seed'] + rank)
+
+    model = SampleRNN(config['frame_sizes'], config['n_rnn'], config['dim'],
+        True, 128, True)
+
+    for tensor in model.state_dict().values():
+        dist.broadcast(tensor, 0)
+
+    predictor = Predictor(model, bf16 = config['bf16'])
+    parameters = list(predictor.parameters())
+    optimizer = gradient_clipping(torch.optim.Adam(parameters, lr = config['lr']))
+
+    # shard of melodies per rank; lazy import of own files only, or memory-mapped
+    # from cache built by train before spawn (all entries current, never stored)
+    dataset = MelodyDataset(config['dir_path'], lazy = True, backend = 'native',
+        cache_dir = config['cache_dir'])
+    loader = MelodyDataLoader(shard(dataset, rank, world_size), config['batch_size'],
+        config['seq_len'], model.lookback, chunked = True, shuffle = True)
+
+    # equal steps per epoch on all ranks, all-reduce in lockstep
+    n_steps = torch.tensor(len(loader))
+    dist.all_reduce(n_steps, op = dist.ReduceOp.MIN)
+    n_steps = int(n_steps)
+
+    if config['max_steps'] is not None:
+        n_steps = min(n_steps, config['max_steps'])
+
+    (step_time, n_samples, loss) = (0.0, 0, None)
+
+    for epoch in range(config['epochs']):
+
+        predictor.train()
+
+        for (step, (inputs, reset, targets)) in zip(range(n_steps), loader):
+
+            def closure():
+                loss = sequence_nll_loss_bits(predictor(inputs, reset), targets)
+                loss.backward()
+                all_reduce_gradients(parameters, world_size)
+                return loss
+
+            start = time.perf_counter()
+            optimizer.zero_grad()
+            loss = optimizer.step(closure).detach()
+
+            # first step excluded from throughput, warm up
+            if epoch or step:
+                step_time += time.perf_counter() - start
+                n_samples += targets.numel() * world_size
+
+            # mean loss over ranks
+            if step % config['log_every'] == 0:
+                dist.all_reduce(loss)
+                loss /= world_size
+                if rank == 0:
+                    print('epoch {} step {}/{} loss {:.4f} bits'.format(
+                        epoch, step, n_steps, loss.item()))
+
+    if rank == 0:
+        results.put((n_samples / step_time if step_time else 0.0,
+            None if loss is None else loss.item()))
+
+    dist.destroy_process_group()
+
+
+def train(dir_path: str, n_procs: int = 1, frame_sizes: tuple = (4, 4), n_rnn: int = 1,
+        dim: int = 512, batch_size: int = 32, seq_len: int = 256, lr: float = 1e-4,
+        epochs: int = 1, max_steps: int = None, bf16: bool = False, cache_dir: str = None,
+        log_every: int = 10, seed: int = 0, port: int = 29500):
+
+    ''' data parallel training over n_procs local processes (gloo)
+
+    Each rank trains on a strided shard of the dataset in pre-chunked TBPTT
+    streams (MelodyDataLoader chunked) with its own Predictor hidden state;
+    gradients are averaged by all-reduce before each step, so all ranks keep
+    identical parameters. Steps per epoch are the minimum over shards.
+
+    Args:
+        dir_path (str): directory of midi files
+        n_procs (int): number of processes
+        frame_sizes (tuple), n_rnn (int), dim (int): model config
+        batch_size (int): parallel streams per rank
+        seq_len (int): TBPTT chunk length, multiple of top tier frame
+        lr (float): Adam learning rate
+        epochs (int): epochs over shards
+        max_steps (int): max steps per epoch, all if None
+        bf16 (bool): bfloat16 autocast training (see Predictor)
+        cache_dir (str): persistent melody cache directory, built (missing or
+            stale entries imported in n_procs workers) before ranks start
+        log_every (int): steps between mean loss logs
+        seed (int): model init and shuffle seed
+        port (int): rendezvous port on localhost
+
+    Returns:
+        (float): training throughput, samples (targets) per second over all ranks
+        (float): loss of last step, rank 0
+    '''
+
+    config = dict(dir_path = dir_path, frame_sizes = frame_sizes, n_rnn = n_rnn, dim = dim,
+        batch_size = batch_size, seq_len = seq_len, lr = lr, epochs = epochs,
+        max_steps = max_steps, bf16 = bf16, cache_dir = cache_dir, log_every = log_every,
+        seed = seed)
+
+    # build persistent cache once, ranks open it without storing
+    if cache_dir is not None:
+        MelodyDataset(dir_path, lazy = True, backend = 'native', cache_dir = cache_dir,
+            workers = n_procs if n_procs > 1 else 0)
+
+    results = mp.get_context('spawn').SimpleQueue()
+
+    mp.spawn(train_worker, args = (n_procs, port, config, results), nprocs = n_procs)
+
+    return results.get()
+
+
+def scaling(dir_path: str, procs: tuple = (1, 2, 4, 8), max_steps: int = 20, **kwargs):
+
+    ''' log weak scaling efficiency of data parallel training, fixed batch per rank
+
+    Efficiency is throughput on n processes over n times throughput on one.
+
+    Returns:
+        (dict): throughput, samples per second, by number of processes
+    '''
+
+    throughput = {}
+
+    for n_procs in procs:
+
+        (throughput[n_procs], _) = train(dir_path, n_procs, max_steps = max_steps,
+            log_every = max_steps, **kwargs)
+
+        print('scaling: {} processes, {:.0f} samples/s, efficiency {:.2f}'.format(n_procs,
+            throughput[n_procs], throughput[n_procs] / (n_procs * throughput[procs[0]])))
+
+    return throughput
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'data parallel melodyrnn training')
+
+    # default to competition midi data
+    parser.add_argument('dir_path', nargs = '?', default = os.path.join(
+        os.path.dirname(__file__), '..', 'data', 'comp-data', 'MIDI'))
+    parser.add_argument('--procs', type = int, default = 1)
+    parser.add_argument('--dim', type = int, default = 512)
+    parser.add_argument('--batch-size', type = int, default = 32)
+    parser.add_argument('--seq-len', type = int, default = 256)
+    parser.add_argument('--epochs', type = int, default = 1)
+    parser.add_argument('--max-steps', type = int, default = None)
+    parser.add_argument('--bf16', action = 'store_true')
+    parser.add_argument('--cache-dir', default = None)
+    parser.add_argument('--scaling', action = 'store_true',
+        help = 'log scaling efficiency over 1, 2, 4, 8 processes')
+
+    args = parser.parse_args()
+
+    kwargs = dict(dim = args.dim, batch_size = args.batch_size, seq_len = args.seq_len,
+        bf16 = args.bf16, cache_dir = args.cache_dir)
+
+    if args.scaling:
+        scaling(args.dir_path, max_steps = args.max_steps or 20, **kwargs)
+        sys.exit()
+
+    (throughput, loss) = train(args.dir_path, args.procs, epochs = args.epochs,
+        max_steps = args.max_steps, **kwargs)
+
+    print('trained on {} processes, {:.0f} samples/s, last loss {:.4f} bits'.format(
+        args.procs, throughput, loss))
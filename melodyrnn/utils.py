@@ -19,6 +19,69 @@ def linear_dequantize(samples, q_levels):
 def q_zero(q_levels):
     return q_levels // 2
 
+def inference_mode():
+
+    ''' return inference mode context, no_grad before torch 1.9 '''
+
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+
+    return torch.no_grad()
+
+def autocast_dtype(device_type):
+
+    ''' return autocast dtype on device type if autocast enabled, else None;
+    per device api (cpu, cuda) before torch 2.4 '''
+
+    if hasattr(torch, 'get_autocast_dtype'):
+        if torch.is_autocast_enabled(device_type):
+            return torch.get_autocast_dtype(device_type)
+        return None
+
+    if device_type == 'cpu':
+        if torch.is_autocast_cpu_enabled():
+            return torch.get_autocast_cpu_dtype()
+        return None
+
+    if device_type == 'cuda' and torch.is_autocast_enabled():
+        return torch.get_autocast_gpu_dtype()
+
+    return None
+
+def transpose(batch, shifts, n_buckets=1):
+
+    ''' transpose melody batch by semitone shift per row
+
+    Non-zero notes shifted and clamped to 7-bit note range (1, 127), silence
+    (zero) preserved; rle tokens (note * n_buckets + bucket) shift the note only.
+
+    Args:
+        batch (torch.Tensor): melodies, shape (batch, length), compact or long
+        shifts (torch.Tensor): semitone shift per row
+        n_buckets (int): rle duration buckets, one for frame melodies
+
+    Returns:
+        (torch.Tensor): transposed melodies, batch dtype
+    '''
+
+    # split note, bucket; widen to avoid compact dtype overflow
+    (notes, buckets) = (batch.long() // n_buckets, batch.long() % n_buckets)
+
+    shifted = (notes + shifts.view(-1, 1).long().to(batch.device)).clamp(1, 127)
+
+    notes = torch.where(notes != 0, shifted, notes)
+
+    return (notes * n_buckets + buckets).to(batch.dtype)
+
+def random_transpose(batch, max_shift=6, n_buckets=1):
+
+    ''' transpose melody batch by random semitone shift per row,
+    uniform over [-max_shift, max_shift] '''
+
+    shifts = torch.randint(-max_shift, max_shift + 1, (batch.size(0),))
+
+    return transpose(batch, shifts, n_buckets)
+
 
 
 def build_audio(M, sr: int = 16000, fr: int = 1014, soft: float = 0.0001):
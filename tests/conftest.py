@@ -0,0 +1,11 @@
+''' imports '''
+
+# filesystem management
+import os
+import sys
+
+# melodyrnn modules import each other flat, as run from package directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'melodyrnn'))
+
+# competition midi data, used by dataset tests
+MIDI_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'comp-data', 'MIDI')
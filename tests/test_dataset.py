@@ -0,0 +1,58 @@
+''' imports '''
+
+# filesystem management
+import os
+import shutil
+
+# array handling
+import numpy as np
+
+# testing
+import pytest
+
+# melody stream, midi data
+from conftest import MIDI_DIR
+from dataset import MelodyStream
+
+
+
+@pytest.fixture
+def midi_dir(tmp_path):
+
+    ''' directory of first five competition midi files '''
+
+    names = sorted( name for name in os.listdir(MIDI_DIR) if 'mid' in name[-4:] )[:5]
+
+    for name in names:
+        shutil.copy(os.path.join(MIDI_DIR, name), tmp_path / name)
+
+    return str(tmp_path)
+
+
+def test_write_shards_from_shards(midi_dir, tmp_path):
+
+    ''' re-sharding shards keeps songs, names and order '''
+
+    MelodyStream(midi_dir, shuffle = False).write_shards(str(tmp_path / 'a'), 2)
+
+    stream = MelodyStream(str(tmp_path / 'a'), shuffle = False)
+    stream.write_shards(str(tmp_path / 'b'), 3)
+
+    resharded = MelodyStream(str(tmp_path / 'b'), shuffle = False)
+
+    assert len(resharded.shard_names) == 2
+    assert resharded.file_names == stream.file_names
+    assert len(resharded) == len(stream) == 5
+
+    for a, b in zip(stream, resharded):
+        assert np.array_equal(a, b)
+
+
+def test_write_shards_to_source(midi_dir, tmp_path):
+
+    ''' shards not written over source shards '''
+
+    MelodyStream(midi_dir, shuffle = False).write_shards(str(tmp_path / 'a'), 2)
+
+    with pytest.raises(ValueError):
+        MelodyStream(str(tmp_path / 'a')).write_shards(str(tmp_path / 'a'))
@@ -0,0 +1,85 @@
+''' imports '''
+
+# tensors
+import torch
+
+# testing
+import pytest
+
+# sample-rnn model and generation
+from model import SampleRNN, Generator
+
+
+
+def small_model():
+
+    ''' small random SampleRNN, fixed seed '''
+
+    torch.manual_seed(0)
+
+    return SampleRNN((4, 4), 1, 32, True, 64, True)
+
+
+def test_call_output_editable():
+
+    ''' generated sequences are normal tensors, editable in place '''
+
+    sequences = Generator(small_model(), cuda = False)(2, 32)
+    sequences += 1
+
+    assert sequences.shape == (2, 32)
+    assert not sequences.is_inference()
+
+
+def test_stream_chunks_editable():
+
+    ''' streamed chunks are normal tensors, editable in place '''
+
+    for chunk in Generator(small_model(), cuda = False).stream(2, 16, 2):
+        chunk += 1
+        assert not chunk.is_inference()
+
+
+def test_compiled_kernel_cached():
+
+    ''' compiled kernel reused over calls, rebuilt on weight change or refresh '''
+
+    model = small_model()
+    generator = Generator(model, cuda = False, compiled = True)
+
+    generator(2, 16)
+    step_kernel = generator.compiled_kernel
+
+    generator(2, 16)
+    assert generator.compiled_kernel is step_kernel
+
+    # in-place weight update
+    with torch.no_grad():
+        model.sample_level_mlp.output.bias.add_(1)
+
+    generator(2, 16)
+    assert generator.compiled_kernel is not step_kernel
+
+    step_kernel = generator.compiled_kernel
+    generator.refresh()
+
+    generator(2, 16)
+    assert generator.compiled_kernel is not step_kernel
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('config', [((4, 4), 1, 32, 64), ((2, 4), 2, 32, 64), ((8, 2, 2), 1, 48, 128)])
+def test_fused_parity(seed, config):
+
+    ''' fused lookup table generates same samples as unfused mlp, same draws '''
+
+    (frame_sizes, n_rnn, dim, q_levels) = config
+
+    torch.manual_seed(seed)
+    model = SampleRNN(frame_sizes, n_rnn, dim, True, q_levels, True)
+    draws = torch.rand(3, 64)
+
+    fused = Generator(model, cuda = False, fused = True)(3, 64, draws)
+    unfused = Generator(model, cuda = False)(3, 64, draws)
+
+    assert torch.equal(fused, unfused)